@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# requirements: Python 3.5
+
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import os.path
+import sys
+import time
+from collections import namedtuple
+
+if __package__:
+    from .convpuki import default_confs, iter_files
+    from .runner import redirect_output, run_convpuki, run_gitify
+else:
+    from convpuki import default_confs, iter_files
+    from runner import redirect_output, run_convpuki, run_gitify
+
+BatchPukiWiki = namedtuple('BatchPukiWiki', ['name', 'basedir', 'size'])
+tools = ['convpuki', 'gitify']
+
+class BatchPukiJob:
+    """A run of convpuki or gitify for a wiki in its own process (gitify changes the working directory)."""
+
+    def __init__(self, wiki, tool, func, basedir, kwargs, logpath):
+        self.wiki = wiki
+        self.tool = tool
+        self.func = func
+        self.basedir = basedir
+        self.kwargs = kwargs
+        self.logpath = logpath
+        self.process = None
+        self.start_time = None
+        self.elapsed = None
+        self.exitcode = None
+
+    def start(self):
+        self.process = multiprocessing.Process(target=run_job, args=(self.logpath, self.func, self.basedir, self.kwargs))
+        self.start_time = time.perf_counter()
+        self.process.start()
+
+    def finish(self):
+        self.process.join()
+        self.elapsed = time.perf_counter() - self.start_time
+        self.exitcode = self.process.exitcode
+
+class BatchPuki:
+    """Migrate many PukiWiki trees with convpuki and gitify on a bounded pool of worker processes.
+
+    The jobs of the largest wikis are started first, so the whole batch takes
+    about as long as the largest wiki when there are enough workers. The
+    numbers of convpuki jobs (disk I/O) and gitify jobs (git processes)
+    running at the same time are limited separately.
+    """
+
+    def __init__(self, basedirs, *,
+                 verbose=False, outdir='pukiwiki-batch', listfile=None, workers=None, max_convpuki=None,
+                 max_gitify=None, jobs=1, name=None, email=None, renamelog=False, update=False, direct=False,
+                 attachments=False, output=None):
+        self.basedirs = list(basedirs)
+        self.verbose = verbose
+        self.outdir = outdir
+        self.listfile = listfile
+        self.workers = workers or os.cpu_count() or 1
+        self.max_convpuki = max_convpuki or self.workers
+        self.max_gitify = max_gitify or self.workers
+        self.jobs = jobs
+        self.name = name
+        self.email = email
+        self.renamelog = renamelog
+        self.update = update
+        self.direct = direct
+        self.attachments = attachments
+        self.output = output
+        self.validate()
+
+    def validate(self):
+        for key in ['workers', 'max_convpuki', 'max_gitify', 'jobs']:
+            if getattr(self, key) < 1:
+                raise ValueError('invalid number of {}: {}'.format(key, getattr(self, key)))
+
+    def run(self):
+        wikis = self.load_wikis()
+        if not wikis:
+            print('no wikis are specified.', file=sys.stderr)
+            exit(1)
+        print('* {} wikis, {} workers'.format(len(wikis), self.workers))
+        start = time.perf_counter()
+        jobs = self.schedule(wikis)
+        elapsed = time.perf_counter() - start
+        report = self.generate_report(wikis, jobs, elapsed)
+        self.report(report)
+        if self.output:
+            with open(self.output, 'w') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+        if any(wiki['status'] != 'ok' for wiki in report['wikis']):
+            exit(1)
+
+    def load_wikis(self):
+        """Read the wiki roots from the arguments and the list file (`basedir` or `basedir<TAB>name` per line)."""
+        entries = [(basedir, None) for basedir in self.basedirs]
+        if self.listfile:
+            with open(self.listfile, encoding='utf-8') as file:
+                for line in file:
+                    line = line.rstrip('\n')
+                    if not line.strip() or line.startswith('#'):
+                        continue
+                    basedir, _, name = line.partition('\t')
+                    entries.append((basedir, name or None))
+        wikis = []
+        names = set()
+        for basedir, name in entries:
+            if name is None:
+                name = os.path.basename(os.path.normpath(basedir))
+            # the output directories must not collide
+            newname = name
+            i = 1
+            while newname in names:
+                i += 1
+                newname = '{}-{}'.format(name, i)
+            names.add(newname)
+            wikis.append(BatchPukiWiki(newname, basedir, tree_size(basedir)))
+        return wikis
+
+    def generate_jobs(self, wiki):
+        wikidir = os.path.join(self.outdir, wiki.name)
+        convdir = os.path.join(wikidir, 'pukiwiki-conv')
+        repodir = os.path.join(wikidir, 'pukiwiki-repo')
+        jobs = []
+        if not self.direct:
+            kwargs = {'outdir': convdir, 'verbose': self.verbose, 'jobs': self.jobs,
+                      'stats_path': os.path.join(wikidir, 'convpuki-stats.json')}
+            jobs.append(BatchPukiJob(wiki, 'convpuki', run_convpuki, wiki.basedir, kwargs,
+                                     os.path.join(wikidir, 'convpuki.log')))
+        kwargs = {'outdir': repodir, 'verbose': self.verbose, 'jobs': self.jobs, 'name': self.name,
+                  'email': self.email, 'renamelog': self.renamelog, 'update': self.update, 'direct': self.direct,
+                  'attachments': self.attachments, 'stats_path': os.path.join(wikidir, 'gitify-stats.json')}
+        jobs.append(BatchPukiJob(wiki, 'gitify', run_gitify, wiki.basedir if self.direct else convdir, kwargs,
+                                 os.path.join(wikidir, 'gitify.log')))
+        for job in jobs:
+            # the stats of the last run must not be mistaken for this run
+            if os.path.exists(job.kwargs['stats_path']):
+                os.remove(job.kwargs['stats_path'])
+        return jobs
+
+    def schedule(self, wikis):
+        """Run the jobs of all wikis and return them; the next job of a wiki starts when the previous one succeeds."""
+        limits = {'convpuki': self.max_convpuki, 'gitify': self.max_gitify}
+        counts = {tool: 0 for tool in tools}
+        queues = {}  # {wiki name: [jobs not started yet]}
+        for wiki in wikis:
+            os.makedirs(os.path.join(self.outdir, wiki.name), exist_ok=True)
+            queues[wiki.name] = self.generate_jobs(wiki)
+        # the first job of each wiki, the largest first
+        ready = sorted((queue.pop(0) for queue in queues.values()), key=lambda job: -job.wiki.size)
+        running = {}  # {sentinel: job}
+        done = []
+        while ready or running:
+            for job in list(ready):
+                if len(running) >= self.workers:
+                    break
+                if counts[job.tool] >= limits[job.tool]:
+                    continue
+                ready.remove(job)
+                self.printv('[start]: {} {}'.format(job.tool, job.wiki.name))
+                job.start()
+                counts[job.tool] += 1
+                running[job.process.sentinel] = job
+            for sentinel in multiprocessing.connection.wait(list(running)):
+                job = running.pop(sentinel)
+                job.finish()
+                counts[job.tool] -= 1
+                done.append(job)
+                if job.exitcode != 0:
+                    print('[error]: {} {} failed, return code: {} (see {})'
+                          .format(job.tool, job.wiki.name, job.exitcode, job.logpath), file=sys.stderr)
+                    continue
+                print('[done]: {} {} ({:.2f}s)'.format(job.tool, job.wiki.name, job.elapsed))
+                queue = queues[job.wiki.name]
+                if queue:
+                    ready.append(queue.pop(0))
+                    ready.sort(key=lambda job: -job.wiki.size)
+        return done
+
+    def generate_report(self, wikis, jobs, elapsed):
+        results = []
+        for wiki in wikis:
+            wikidir = os.path.join(self.outdir, wiki.name)
+            wiki_jobs = [job for job in jobs if job.wiki is wiki]
+            # the jobs after a failed one are not run
+            ok = all(job.exitcode == 0 for job in wiki_jobs) and wiki_jobs[-1].tool == 'gitify'
+            result = {'name': wiki.name, 'basedir': wiki.basedir, 'size': wiki.size, 'status': 'ok' if ok else 'failed'}
+            for job in wiki_jobs:
+                result[job.tool] = {'elapsed': job.elapsed, 'exitcode': job.exitcode, 'log': job.logpath}
+                statspath = os.path.join(wikidir, job.tool + '-stats.json')
+                if os.path.exists(statspath):
+                    with open(statspath) as file:
+                        result[job.tool]['counters'] = json.load(file)['counters']
+            results.append(result)
+        job_time = sum(job.elapsed for job in jobs)
+        wiki_times = [sum(result[tool]['elapsed'] for tool in tools if tool in result) for result in results]
+        return {
+            'elapsed': elapsed,
+            'job_time': job_time,
+            'longest_wiki': max(wiki_times) if wiki_times else 0.0,
+            'workers': self.workers,
+            'wikis': results,
+        }
+
+    def report(self, report):
+        for result in report['wikis']:
+            line = '{name}: {status}, {size} bytes'.format(**result)
+            for tool in tools:
+                if tool in result:
+                    line += ', {} {:.2f}s'.format(tool, result[tool]['elapsed'])
+            commits = result.get('gitify', {}).get('counters', {}).get('commits')
+            if commits is not None:
+                line += ', {} commits'.format(commits)
+            print(line)
+        print('* {} wikis in {:.2f}s (total time of the jobs: {:.2f}s, longest wiki: {:.2f}s)'
+              .format(len(report['wikis']), report['elapsed'], report['job_time'], report['longest_wiki']))
+        failed = [result['name'] for result in report['wikis'] if result['status'] != 'ok']
+        if failed:
+            print('* failed: {}'.format(', '.join(failed)))
+
+    def printv(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+def tree_size(basedir):
+    # only the directories which convpuki reads
+    size = 0
+    roots = {conf.pattern.split('/')[0] for conf in default_confs}
+    for root in roots:
+        for path, _ in iter_files(os.path.join(basedir, root), root):
+            size += os.path.getsize(path)
+    return size
+
+def run_job(logpath, func, basedir, kwargs):
+    with redirect_output(logpath):
+        func(basedir, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description='migrate many PukiWiki trees with convpuki and gitify in parallel')
+    parser.add_argument('basedirs', nargs='*', metavar='basedir',
+                        help='PukiWiki root directories (which have index.php)')
+    parser.add_argument('-l', '--list', dest='listfile', metavar='FILE',
+                        help='file which lists the PukiWiki root directories (`basedir` or `basedir<TAB>name` per line)')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                        help='show verbose log (in the log files)')
+    parser.add_argument('-o', '--outdir', default='pukiwiki-batch',
+                        help='output directory which has a directory for each wiki (default: pukiwiki-batch)')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='number of jobs running at the same time (default: number of CPUs)')
+    parser.add_argument('--max-convpuki', dest='max_convpuki', type=int,
+                        help='number of convpuki jobs running at the same time (default: same as --workers)')
+    parser.add_argument('--max-gitify', dest='max_gitify', type=int,
+                        help='number of gitify jobs running at the same time (default: same as --workers)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes of each convpuki and gitify (default: 1)')
+    parser.add_argument('-n', '--name', help='git author and committer name')
+    parser.add_argument('-e', '--email', help='git author and committer email')
+    parser.add_argument('-r', '--renamelog', dest='renamelog', action='store_true', default=False,
+                        help='parse rename log and execute git mv (experimental)')
+    parser.add_argument('-U', '--update', dest='update', action='store_true', default=False,
+                        help='append revisions newer than the last run to the existing repositories')
+    parser.add_argument('-D', '--direct', dest='direct', action='store_true', default=False,
+                        help='run gitify on the original PukiWiki trees without convpuki')
+    parser.add_argument('-a', '--attachments', dest='attachments', action='store_true', default=False,
+                        help='import attached files into attach/ at their modification times')
+    parser.add_argument('-O', '--output',
+                        help='write the report to this file as JSON')
+    params = parser.parse_args()
+
+    batchpuki = BatchPuki(**vars(params))
+    batchpuki.run()
+
+if __name__ == '__main__':
+    main()
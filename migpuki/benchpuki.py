@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# requirements: Python 3.5
+
+import argparse
+import json
+import multiprocessing
+import os
+import os.path
+import resource
+import shutil
+import subprocess
+import time
+
+if __package__:
+    from .genpuki import GenPuki
+    from .runner import redirect_output, run_convpuki, run_gitify
+else:
+    from genpuki import GenPuki
+    from runner import redirect_output, run_convpuki, run_gitify
+
+class BenchPuki:
+    """Run convpuki and gitify on a tree generated by genpuki and measure them."""
+
+    def __init__(self, workdir, *,
+                 verbose=False, pages=1000, revisions=10, page_size=2048, attachments=100, seed=0,
+                 regenerate=False, jobs=1, backend='fast-import', streaming=False, output=None):
+        self.workdir = os.path.abspath(workdir)
+        self.verbose = verbose
+        self.pages = pages
+        self.revisions = revisions
+        self.page_size = page_size
+        self.attachments = attachments
+        self.seed = seed
+        self.regenerate = regenerate
+        self.jobs = jobs
+        self.backend = backend
+        self.streaming = streaming
+        self.output = output
+
+    def run(self):
+        rawdir = os.path.join(self.workdir, 'pukiwiki')
+        convdir = os.path.join(self.workdir, 'pukiwiki-conv')
+        repodir = os.path.join(self.workdir, 'pukiwiki-repo')
+        corpus = self.generate(rawdir)
+        results = []
+        for outdir in [convdir, repodir]:
+            if os.path.exists(outdir):
+                shutil.rmtree(outdir)
+        print('* running convpuki...')
+        result = self.measure('convpuki', run_convpuki, rawdir,
+                              outdir=convdir, verbose=self.verbose, jobs=self.jobs, full=True)
+        result['files_per_sec'] = corpus['files'] / result['elapsed']
+        results.append(result)
+        print('* running gitify...')
+        result = self.measure('gitify', run_gitify, convdir,
+                              outdir=repodir, verbose=self.verbose, name='benchpuki', email='benchpuki@example.com',
+                              renamelog=True, backend=self.backend, streaming=self.streaming, jobs=self.jobs)
+        commits = int(subprocess.check_output(['git', '-C', repodir, 'rev-list', '--count', 'HEAD']).decode('ascii'))
+        result['commits'] = commits
+        result['revisions_per_sec'] = corpus['revisions'] / result['elapsed']
+        results.append(result)
+        self.report(corpus, results)
+        if self.output:
+            with open(self.output, 'w') as file:
+                json.dump({'corpus': corpus, 'results': results}, file, indent=2, sort_keys=True)
+                file.write('\n')
+
+    def generate(self, rawdir):
+        corpuspath = os.path.join(self.workdir, 'genpuki.json')
+        params = {'pages': self.pages, 'revisions': self.revisions, 'page_size': self.page_size,
+                  'attachments': self.attachments, 'seed': self.seed,
+                  # genpuki renames 10 pages by default, which needs at least 10 pages
+                  'renames': min(10, self.pages)}
+        if os.path.exists(corpuspath) and not self.regenerate:
+            with open(corpuspath) as file:
+                corpus = json.load(file)
+            if corpus['params'] == params:
+                print('* reusing the corpus in {}'.format(rawdir))
+                return corpus
+        if os.path.exists(rawdir):
+            shutil.rmtree(rawdir)
+        print('* generating a corpus in {}...'.format(rawdir))
+        corpus = GenPuki(rawdir, **params).run()
+        corpus['params'] = params
+        with open(corpuspath, 'w') as file:
+            json.dump(corpus, file, sort_keys=True)
+        return corpus
+
+    def measure(self, tool, func, *args, **kwargs):
+        # run each tool in its own process, so that the peak RSS and the chdir in gitify do not leak
+        logpath = os.path.join(self.workdir, tool + '.log')
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure_child, args=(queue, logpath, func, args, kwargs))
+        process.start()
+        result = queue.get()
+        process.join()
+        if process.exitcode != 0:
+            raise Exception('failed: {}, return code: {} (see {})'.format(tool, process.exitcode, logpath))
+        result['name'] = tool
+        return result
+
+    def report(self, corpus, results):
+        print('corpus: {pages} pages, {revisions} revisions, {files} files, {bytes} bytes'.format(**corpus))
+        for result in results:
+            rate = 'files/s: {:.1f}'.format(result['files_per_sec']) if 'files_per_sec' in result \
+                else 'revisions/s: {:.1f}'.format(result['revisions_per_sec'])
+            print('{name}: {elapsed:.2f}s (user {user:.2f}s, sys {sys:.2f}s), {rate}, '
+                  'peak RSS: {maxrss_self} KiB (children {maxrss_children} KiB), subprocesses: {subprocesses}'
+                  .format(rate=rate, **result))
+
+def measure_child(queue, logpath, func, args, kwargs):
+    counter = {'subprocesses': 0}
+    popen = subprocess.Popen
+
+    class CountingPopen(popen):
+        def __init__(self, *args, **kwargs):
+            counter['subprocesses'] += 1
+            super().__init__(*args, **kwargs)
+
+    subprocess.Popen = CountingPopen
+    result = {}
+    try:
+        with redirect_output(logpath):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            result['elapsed'] = time.perf_counter() - start
+    finally:
+        subprocess.Popen = popen
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result.update({
+            'user': usage_self.ru_utime + usage_children.ru_utime,
+            'sys': usage_self.ru_stime + usage_children.ru_stime,
+            # KiB on Linux, bytes on macOS
+            'maxrss_self': usage_self.ru_maxrss,
+            'maxrss_children': usage_children.ru_maxrss,
+            'subprocesses': counter['subprocesses'],
+        })
+        queue.put(result)
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark convpuki and gitify with synthetic PukiWiki data')
+    parser.add_argument('workdir',
+                        help='working directory which keeps the generated corpus, the outputs and the logs')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                        help='show verbose log (in the log files)')
+    parser.add_argument('-N', '--pages', type=int, default=1000,
+                        help='number of pages (default: 1000)')
+    parser.add_argument('-R', '--revisions', type=int, default=10,
+                        help='average number of revisions per page (default: 10)')
+    parser.add_argument('-S', '--page-size', dest='page_size', type=int, default=2048,
+                        help='approximate size of a revision in bytes (default: 2048)')
+    parser.add_argument('--attachments', type=int, default=100,
+                        help='number of attached files (default: 100)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    parser.add_argument('-G', '--regenerate', dest='regenerate', action='store_true', default=False,
+                        help='generate the corpus again even if it exists')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes of convpuki and gitify (default: 1)')
+    parser.add_argument('-b', '--backend', default='fast-import',
+                        help='backend of gitify: fast-import (default) or subprocess')
+    parser.add_argument('-s', '--streaming', dest='streaming', action='store_true', default=False,
+                        help='run gitify in streaming mode')
+    parser.add_argument('-O', '--output',
+                        help='write the results to this file as JSON')
+    params = parser.parse_args()
+
+    os.makedirs(params.workdir, exist_ok=True)
+    benchpuki = BenchPuki(**vars(params))
+    benchpuki.run()
+
+if __name__ == '__main__':
+    main()
@@ -3,30 +3,264 @@
 
 import argparse
 import codecs
-import glob
 import gzip as gziplib
+import hashlib
+import io
+import json
 import os
 import os.path
 import re
 import shutil
 import subprocess
 import sys
+import threading
 import unicodedata
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+if __package__:
+    from .stats import Stats
+else:
+    from stats import Stats
 
 ConvPukiConf = namedtuple('ConvPukiConf', ['pattern', 'excludes', 'gzip', 'fileconv', 'pathconv'])
+ConvPukiTask = namedtuple('ConvPukiTask', ['oldpath', 'newpath', 'gzip', 'fileconv', 'pathconv', 'sha1', 'encoding'])
+ConvPukiResult = namedtuple('ConvPukiResult', ['oldpath', 'newpath', 'error', 'rawpath', 'sha1', 'skipped', 'encoding'])
 pathbadchars = {':'}
 encoding_alias_map = {
     'euc_jp': {'eucjp', 'euc-jp'},
     'utf-8': {'utf8', 'utf_8'},
 }
 valid_encodings = {'euc_jp', 'utf-8'}
+# tried after encoding_from when a file cannot be decoded with it; none by default, because the vendor
+# extensions of CP51932 are not in any codec of the standard library (EUC-JIS-2004 has different kanji
+# at rows 89-92) and such files are repaired by repairpuki.py instead
+default_fallback_encodings = {
+    'euc_jp': [],
+    'utf-8': [],
+}
 valid_normalizations = {'NFC', 'NFD', 'NFKC', 'NFKD'}
+valid_link_modes = {'copy', 'hardlink', 'reflink', 'copy_file_range'}
+FICLONE = 0x40049409  # ioctl(2) of Linux to share the extents of a file (reflink)
+chunk_size = 64 * 1024
+rawcopy_limit = 4 * 1024 * 1024
+# 3 or 4-byte sequences of UTF-8; EUC-JP text which is valid UTF-8 as a whole (e.g. '側' is U+00A6 in UTF-8)
+# rarely has them, so only such files are tried as UTF-8 before encoding_from
+utf8_multibyte_re = re.compile(rb'[\xe0-\xef][\x80-\xbf]{2}|[\xf0-\xf4][\x80-\xbf]{3}')
+classify_limit = 16 * 1024 * 1024  # larger files are converted as a stream from encoding_from without classification
+gzip_block_size = 256 * 1024  # size of an uncompressed gzip member written by ParallelGzipWriter
+manifest_name = '.convpuki-manifest.jsonl'
+max_reported_errors = 10
+default_confs = [
+    ConvPukiConf('wiki/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
+    ConvPukiConf('backup/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
+    ConvPukiConf('backup/**/*.gz', {}, gzip=True, fileconv=True, pathconv=True),
+    ConvPukiConf('diff/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
+    ConvPukiConf('counter/**/*.count', {}, gzip=False, fileconv=True, pathconv=True),
+    ConvPukiConf('cache/**/*', {r'\.(?:re[fl]|tmp)$', r'/autolink\.dat$'}, gzip=False, fileconv=True, pathconv=False),
+    ConvPukiConf('attach/**/*', {r'/dir\.txt$', r'\.log$'}, gzip=False, fileconv=False, pathconv=True),
+]
+
+# thread pool of ParallelGzipWriter, created in each worker process
+_gzip_executor = None
+
+# errors='replace' which also records where the errors are
+_recorded_errors = threading.local()
+
+def _replace_and_record(e):
+    # the codecs may reuse the exception object, so keep copies of its contents
+    _recorded_errors.errors.append((len(e.object), e.start, e.object[e.start:e.end]))
+    if isinstance(e, UnicodeDecodeError):
+        return ('\ufffd', e.end)
+    return ('?' * (e.end - e.start), e.end)
+
+codecs.register_error('convpuki-replace', _replace_and_record)
+
+class TeeReader:
+    """Hash the bytes read from `file` and keep them (up to `limit`) to copy the raw file without reading it again."""
+
+    def __init__(self, file, limit):
+        self.file = file
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.overflowed = False
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.sha1.update(chunk)
+        if not self.overflowed:
+            self.size += len(chunk)
+            if self.size > self.limit:
+                self.overflowed = True
+                self.chunks = []
+            else:
+                self.chunks.append(chunk)
+        return chunk
+
+    def drain(self):
+        while self.read(chunk_size):
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # the source file is closed by its owner
+        pass
+
+class ChainReader:
+    """Read `head` and then the rest of `file`."""
+
+    def __init__(self, head, file):
+        self.head = head
+        self.file = file
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.file.read(size)
+        if size < 0:
+            chunk, self.head = self.head + self.file.read(), b''
+        else:
+            chunk, self.head = self.head[:size], self.head[size:]
+        return chunk
+
+class ParallelGzipWriter:
+    """Write a multi-member gzip file whose blocks are compressed on a thread pool.
+
+    zlib releases the GIL while compressing, so the blocks of a large file are
+    compressed in parallel. Each block is an independent gzip member, and
+    readers of gzip (gzip -d, PHP's gzopen() used by PukiWiki, ...) read the
+    concatenated members as one stream.
+    """
+
+    def __init__(self, path, executor, *, threads, compresslevel=9, mtime=None, block_size=gzip_block_size):
+        self.file = open(path, 'wb')
+        self.executor = executor
+        self.max_pending = threads * 2
+        self.compresslevel = compresslevel
+        self.mtime = mtime
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()  # futures of the compressed members in order
+        self.members = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.executor.submit(compress_gzip_member, block, self.compresslevel, self.mtime))
+        self.members += 1
+        # bound the memory held by the blocks which have not been written yet
+        while len(self.pending) > self.max_pending:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            # an empty file is still written as one (empty) member
+            if self.buffer or not self.members:
+                self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+        finally:
+            self.file.close()
+            self.file = None
+
+class ConvPukiManifest:
+    """Journal of the converted files in the output directory.
+
+    The first line holds the conversion options and each following line is a
+    JSON object of a source file: its path relative to basedir, size, mtime,
+    SHA-1, its outputs relative to outdir and the encoding it was decoded
+    with (tried first when the file is converted again). Lines are appended as soon as
+    each file is converted (the last line of a path wins), so an interrupted
+    run can be resumed. The journal is compacted at the end of a complete run.
+    """
+
+    def __init__(self, outdir, options):
+        self.path = os.path.join(outdir, manifest_name)
+        self.options = options
+        self.entries = {}  # {path: entry}
+        self.file = None
+
+    def load(self):
+        """Load the journal and return False if it was written with other options."""
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return True
+        with open(self.path, encoding='utf-8') as file:
+            header = json.loads(file.readline() or '{}')
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be broken when the run was interrupted
+                    continue
+                if entry.get('deleted'):
+                    self.entries.pop(entry['path'], None)
+                else:
+                    self.entries[entry['path']] = entry
+        return header.get('options') == self.options
+
+    def reset(self):
+        self.entries = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def open(self):
+        exists = os.path.exists(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        if not exists:
+            self.write({'options': self.options})
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False, sort_keys=True) + '\n')
+
+    def update(self, path, stat, sha1, outputs, encoding=None):
+        entry = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1, 'outputs': outputs,
+                 'encoding': encoding}
+        self.entries[path] = entry
+        self.write(entry)
+
+    def remove(self, path):
+        self.entries.pop(path, None)
+        self.write({'path': path, 'deleted': True})
+
+    def compact(self):
+        self.close()
+        newpath = self.path + '.tmp'
+        with open(newpath, 'w', encoding='utf-8') as self.file:
+            self.write({'options': self.options})
+            for path in sorted(self.entries):
+                self.write(self.entries[path])
+        os.replace(newpath, self.path)
+        self.file = None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
 
 class ConvPuki:
     def __init__(self, basedir, *,
                  verbose=False, outdir='pukiwiki-conv', encoding_from='euc_jp', encoding_to='utf-8',
-                 fileconv=True, pathconv=True, outhexpath=False, normalization='NFC'):
+                 fileconv=True, pathconv=True, outhexpath=False, normalization='NFC', jobs=1, full=False,
+                 stats_path=None, link_mode='copy', fallback_encodings=None, compresslevel=9, gzip_threads=1,
+                 prefer_utf8=False):
         self.basedir = basedir
         self.verbose = verbose
         self.outdir = outdir
@@ -36,6 +270,14 @@ class ConvPuki:
         self.pathconv = pathconv
         self.outhexpath = outhexpath
         self.normalization = normalization
+        self.jobs = jobs
+        self.full = full
+        self.stats = Stats(stats_path)
+        self.link_mode = link_mode
+        self.fallback_encodings = fallback_encodings
+        self.compresslevel = compresslevel
+        self.gzip_threads = gzip_threads
+        self.prefer_utf8 = prefer_utf8
         self.validate()
 
     def validate(self):
@@ -54,70 +296,343 @@ class ConvPuki:
             raise ValueError('invalid normalization mode: ' + self.normalization)
         if not self.outhexpath and self.encoding_to != 'utf-8':
             raise ValueError('you must set --outhexpath (-x) when you specify --encoding_to euc_jp' + self.normalization)
+        if self.jobs < 1:
+            raise ValueError('invalid number of jobs: ' + str(self.jobs))
+        if self.link_mode not in valid_link_modes:
+            raise ValueError('invalid link mode: ' + self.link_mode)
+        if not 0 <= self.compresslevel <= 9:
+            raise ValueError('invalid compression level: ' + str(self.compresslevel))
+        if self.gzip_threads < 1:
+            raise ValueError('invalid number of gzip threads: ' + str(self.gzip_threads))
+        if self.fallback_encodings is None:
+            self.fallback_encodings = default_fallback_encodings[self.encoding_from]
+        for encoding in self.fallback_encodings:
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                raise ValueError('invalid encoding (fallback): ' + encoding)
 
     def run(self):
-        confs = [
-            ConvPukiConf('wiki/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
-            ConvPukiConf('backup/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
-            ConvPukiConf('backup/**/*.gz', {}, gzip=True, fileconv=True, pathconv=True),
-            ConvPukiConf('diff/**/*.txt', {r'/dir\.txt$'}, gzip=False, fileconv=True, pathconv=True),
-            ConvPukiConf('counter/**/*.count', {}, gzip=False, fileconv=True, pathconv=True),
-            ConvPukiConf('cache/**/*', {r'\.(?:re[fl]|tmp)$', r'/autolink\.dat$'}, gzip=False, fileconv=True, pathconv=False),
-            ConvPukiConf('attach/**/*', {r'/dir\.txt$', r'\.log$'}, gzip=False, fileconv=False, pathconv=True),
-        ]
+        confs = default_confs
+        os.makedirs(self.outdir, exist_ok=True)
+        manifest = ConvPukiManifest(self.outdir, self.manifest_options())
+        with self.stats.phase('load manifest'):
+            if not manifest.load():
+                print('* conversion options have been changed; removing the previous outputs...')
+                for entry in manifest.entries.values():
+                    self.remove_outputs(entry['outputs'])
+                manifest.reset()
+        counts = {'converted': 0, 'unchanged': 0, 'removed': 0}
+        failures = []
+        seen = set()
+        manifest.open()
+        executor = ProcessPoolExecutor(self.jobs) if self.jobs > 1 else None
+        try:
+            print('* scanning {} ...'.format(self.basedir))
+            with self.stats.phase('scan'):
+                all_tasks = self.scan_tasks(confs)
+            for conf, conf_tasks in zip(confs, all_tasks):
+                print('* converting {} ...'.format(conf.pattern))
+                with self.stats.phase('convert ' + conf.pattern):
+                    self.stats.count('files_scanned', len(conf_tasks))
+                    self.convert_tasks(conf_tasks, manifest, executor, counts, failures, seen)
+            # remove the outputs of deleted source files
+            with self.stats.phase('cleanup'):
+                for path in set(manifest.entries) - seen:
+                    self.remove_outputs(manifest.entries[path]['outputs'])
+                    manifest.remove(path)
+                    counts['removed'] += 1
+                manifest.compact()
+        finally:
+            manifest.close()
+            if executor:
+                executor.shutdown()
+        for key, count in counts.items():
+            self.stats.count('files_' + key, count)
+        self.stats.count('files_failed', len(failures))
+        self.report_summary(counts, failures)
+        self.stats.write()
+
+    def convert_tasks(self, conf_tasks, manifest, executor, counts, failures, seen):
+        tasks = []
+        stats = {}
+        for task in conf_tasks:
+            path = os.path.relpath(task.oldpath, self.basedir)
+            seen.add(path)
+            stat = os.stat(task.oldpath)
+            entry = manifest.entries.get(path)
+            if entry and not self.full:
+                if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                    counts['unchanged'] += 1
+                    continue
+                # only the mtime may have been changed; compare the hash before converting
+                task = task._replace(sha1=entry['sha1'])
+            if entry:
+                task = task._replace(encoding=entry.get('encoding'))
+            tasks.append(task)
+            stats[task.oldpath] = stat
+        if executor:
+            # map() keeps the order of tasks, so the reports are the same as the serial run
+            chunksize = max(1, min(64, len(tasks) // (self.jobs * 4)))
+            results = executor.map(self.convpuki_task, tasks, chunksize=chunksize)
+        else:
+            results = map(self.convpuki_task, tasks)
+        with self.stats.progress('convert', len(tasks)) as progress:
+            for result in results:
+                path = os.path.relpath(result.oldpath, self.basedir)
+                entry = manifest.entries.get(path)
+                stat = stats[result.oldpath]
+                self.stats.count('bytes_read', stat.st_size)
+                progress.update(nbytes=stat.st_size)
+                if result.skipped:
+                    counts['unchanged'] += 1
+                    manifest.update(path, stat, result.sha1, entry['outputs'], entry.get('encoding'))
+                    continue
+                counts['converted'] += 1
+                outputs = [os.path.relpath(p, self.outdir) for p in [result.newpath, result.rawpath] if p]
+                if entry:
+                    self.remove_outputs(set(entry['outputs']) - set(outputs))
+                manifest.update(path, stat, result.sha1, outputs, result.encoding)
+                if result.encoding:
+                    self.stats.count('files_' + result.encoding)
+                if self.stats.enabled:
+                    self.stats.count('bytes_written', sum(os.path.getsize(p) for p in [result.newpath, result.rawpath] if p))
+                if result.error:
+                    self.report_failure(result)
+                    failures.append(result)
+
+    def manifest_options(self):
+        keys = ['encoding_from', 'encoding_to', 'fileconv', 'pathconv', 'outhexpath', 'normalization',
+                'fallback_encodings', 'prefer_utf8']
+        return {key: getattr(self, key) for key in keys}
+
+    def remove_outputs(self, outputs):
+        for output in outputs:
+            path = os.path.join(self.outdir, output)
+            if os.path.lexists(path):
+                self.printv('[remove]: ' + path)
+                os.remove(path)
+
+    def scan_tasks(self, confs):
+        """Walk the source tree once and return the list of tasks for each conf."""
+        # the first conf whose pattern matches the path wins, like running the globs in order
+        matcher = re.compile('|'.join('(?P<c{}>{})'.format(i, glob_to_regex(conf.pattern)) for i, conf in enumerate(confs)))
+        excludes = [re.compile('|'.join(conf.excludes)) if conf.excludes else None for conf in confs]
+        # each pattern starts with a literal directory, so only those directories are walked
+        roots = []
         for conf in confs:
-            print('* converting {} ...'.format(conf.pattern))
-            pattern = os.path.join(self.basedir, conf.pattern)
-            excludes = {re.compile(s) for s in conf.excludes}
-            for oldpath in glob.iglob(pattern, recursive=True):
-                if os.path.isfile(oldpath):
-                    banned = False
-                    for exclude_re in excludes:
-                        if exclude_re.search(oldpath):
-                            banned = True
-                            break
-                    if not banned:
-                        fileconv = False if not self.fileconv else conf.fileconv
-                        pathconv = False if not self.pathconv else conf.pathconv
-                        self.convpuki_file(oldpath, gzip=conf.gzip, fileconv=fileconv, pathconv=pathconv)
-
-    def convpuki_file(self, oldpath: str, *, gzip=False, fileconv=False, pathconv=True):
-        newpath = self.generate_new_path(oldpath, pathconv=pathconv)
+            root = conf.pattern.split('/')[0]
+            if root not in roots:
+                roots.append(root)
+        tasks = [[] for conf in confs]
+        names = {}
+        for root in roots:
+            for oldpath, relpath in iter_files(os.path.join(self.basedir, root), root):
+                match = matcher.fullmatch(relpath)
+                if not match:
+                    continue
+                i = int(match.lastgroup[1:])
+                conf = confs[i]
+                if excludes[i] and excludes[i].search('/' + relpath):
+                    continue
+                fileconv = False if not self.fileconv else conf.fileconv
+                pathconv = False if not self.pathconv else conf.pathconv
+                newpath = self.generate_new_path(oldpath, pathconv=pathconv, names=names)
+                tasks[i].append(ConvPukiTask(oldpath, newpath, conf.gzip, fileconv, pathconv, None, None))
+        return tasks
+
+    def convpuki_task(self, task: ConvPukiTask):
+        if task.sha1 is not None:
+            sha1 = hash_file(task.oldpath)
+            if sha1 == task.sha1:
+                return ConvPukiResult(task.oldpath, None, None, None, sha1, True, None)
+        return self.convpuki_file(task.oldpath, gzip=task.gzip, fileconv=task.fileconv, pathconv=task.pathconv,
+                                  newpath=task.newpath, encoding=task.encoding)
+
+    def convpuki_file(self, oldpath: str, *, gzip=False, fileconv=False, pathconv=True, newpath=None, encoding=None):
+        if newpath is None:
+            newpath = self.generate_new_path(oldpath, pathconv=pathconv)
         self.printv('--')
         self.printv('[old]: ' + oldpath)
         self.printv('[new]: ' + newpath)
         newdirname = os.path.dirname(newpath)
-        if not os.path.exists(newdirname):
-            os.makedirs(newdirname)
+        # other workers may create the same directory at the same time
+        os.makedirs(newdirname, exist_ok=True)
         if not fileconv or self.encoding_from == self.encoding_to:
-            shutil.copy(oldpath, newpath)
+            # the output may be a hard link to the source; never write into it
+            if os.path.lexists(newpath):
+                os.remove(newpath)
+            if link_file(oldpath, newpath, self.link_mode):
+                # not hashed to avoid reading the file; compared by size and mtime only next time
+                self.printv('[{}]: succeeded.'.format(self.link_mode))
+                return ConvPukiResult(oldpath, newpath, None, None, None, False, None)
+            sha1 = copy_file(oldpath, newpath)
             self.printv('[copy]: succeeded.')
+            return ConvPukiResult(oldpath, newpath, None, None, sha1, False, None)
+        # classify the content in memory and convert it with the encoding found; if it cannot be decoded with any
+        # of them (or it is too large), convert it with errors='replace', keeping the raw bytes
+        with open(oldpath, 'rb') as rawfile:
+            tee = TeeReader(rawfile, rawcopy_limit)
+            with gziplib.GzipFile(fileobj=tee, mode='rb') if gzip else tee as oldfile:
+                head = oldfile.read(classify_limit + 1)
+                newdata = None
+                if len(head) <= classify_limit:
+                    encoding, newdata = self.fileconv_classified(head, hint=encoding)
+                with self.open_new_file(newpath, oldpath, gzip=gzip) as newfile:
+                    if newdata is not None:
+                        newfile.write(newdata)
+                        errors = []
+                    else:
+                        encoding = None
+                        errors = self.fileconv_stream(ChainReader(head, oldfile), newfile, errors='replace')
+            tee.drain()
+            sha1 = tee.sha1.hexdigest()
+            copy_mtime(oldpath, newpath)
+            if not errors:
+                self.printv('[convert] succeeded ({}).'.format(encoding or self.encoding_from))
+                return ConvPukiResult(oldpath, newpath, None, None, sha1, False, encoding)
+        newrawpath = newpath + '.' + self.encoding_from
+        if tee.overflowed:
+            shutil.copy2(oldpath, newrawpath)
         else:
-            try:
-                openf = gziplib.open if gzip else open
-                with openf(newpath, 'wb') as newfile:
-                    with openf(oldpath, 'rb') as oldfile:
-                        self.fileconv_stream(oldfile, newfile)
-                self.printv('[convert] succeeded.')
-            except UnicodeError as e:
-                print('[error]: {} -> {} \n{}'.format(oldpath, newpath, e), file=sys.stderr)
-                with openf(newpath, 'wb') as newfile:
-                    with openf(oldpath, 'rb') as oldfile:
-                        self.fileconv_stream(oldfile, newfile, errors='replace')
-                newrawpath = newpath + '.' + self.encoding_from
-                shutil.copy(oldpath, newrawpath)
-                print('[copy]: {} -> {}'.format(oldpath, newrawpath), file=sys.stderr)
-                print('')
+            with open(newrawpath, 'wb') as rawcopy:
+                rawcopy.writelines(tee.chunks)
+            shutil.copystat(oldpath, newrawpath)
+        return ConvPukiResult(oldpath, newpath, self.describe_errors(errors), newrawpath, sha1, False, None)
+
+    def open_new_file(self, newpath, oldpath, *, gzip=False):
+        if gzip:
+            # keep the mtime of the source in the gzip header, so that the output does not depend on when it was run
+            mtime = int(os.stat(oldpath).st_mtime)
+            if self.gzip_threads > 1:
+                return ParallelGzipWriter(newpath, gzip_executor(self.gzip_threads), threads=self.gzip_threads,
+                                          compresslevel=self.compresslevel, mtime=mtime)
+            return gziplib.GzipFile(newpath, 'wb', compresslevel=self.compresslevel, mtime=mtime)
+        return open(newpath, 'wb')
+
+    def report_failure(self, result: ConvPukiResult):
+        print('[error]: {} -> {} \n{}'.format(result.oldpath, result.newpath, result.error), file=sys.stderr)
+        print('[copy]: {} -> {}'.format(result.oldpath, result.rawpath), file=sys.stderr)
+        print('')
+
+    def report_summary(self, counts, failures):
+        print('* {converted} files converted, {unchanged} files unchanged, {removed} files removed.'.format(**counts))
+        if failures:
+            print('* {} files could not be decoded and were converted with errors=replace.'.format(len(failures)))
+            print('  the original files were copied as follows:')
+            for result in failures:
+                print('  {}'.format(result.rawpath))
 
     def fileconv_stream(self, oldfile, newfile, *, errors='strict'):
-        # FIXME: should use I/O stream
-        decoded = oldfile.read().decode(self.encoding_from, errors=errors)
-        newfile.write(decoded.encode(self.encoding_to, errors=errors))
+        """Convert `oldfile` into `newfile` chunk by chunk with incremental codecs.
+
+        With errors='replace', the replaced errors are returned as a list of
+        (byte offset in oldfile, undecodable bytes) for decoding errors and
+        (None, unencodable text) for encoding errors.
+        """
+        recording = errors == 'replace'
+        if recording:
+            errors = 'convpuki-replace'
+        decoder = codecs.getincrementaldecoder(self.encoding_from)(errors)
+        encoder = codecs.getincrementalencoder(self.encoding_to)(errors)
+        _recorded_errors.errors = []
+        results = []
+        position = 0
+        while True:
+            chunk = oldfile.read(chunk_size)
+            final = not chunk
+            decoded = decoder.decode(chunk, final)
+            for objectlen, start, data in _recorded_errors.errors:
+                # the decoded object is the bytes pending in the decoder followed by this chunk
+                results.append((position + len(chunk) - objectlen + start, bytes(data)))
+            _recorded_errors.errors = []
+            newfile.write(encoder.encode(decoded, final))
+            for _, _, data in _recorded_errors.errors:
+                results.append((None, data))
+            _recorded_errors.errors = []
+            position += len(chunk)
+            if final:
+                break
+        return results if recording else []
+
+    def fileconv_classified(self, data: bytes, *, hint=None):
+        """Decode `data` strictly with the first encoding which can decode it and convert it to encoding_to.
+
+        The encodings are tried in the order of `hint` (the result of the last
+        run), ascii, encoding_from, encoding_to and the fallback encodings.
+        Short runs of UTF-8 are often valid EUC-JP ('café' as 'caf辿') and
+        vice versa ('側' as '¦'), so utf-8 (as encoding_to) is tried before
+        encoding_from only if `data` has 3 or 4-byte sequences of UTF-8, as
+        Japanese text in UTF-8 does, or if prefer_utf8 is set. Returns the
+        encoding and the converted bytes (`data` itself if it is already valid
+        in encoding_to), or (None, None) if none of them fits.
+        """
+        encodings = [hint] if hint else []
+        order = [self.encoding_from, self.encoding_to]
+        if self.encoding_to == 'utf-8' and (self.prefer_utf8 or utf8_multibyte_re.search(data)):
+            order.reverse()
+        for encoding in ['ascii'] + order + self.fallback_encodings:
+            if encoding not in encodings:
+                encodings.append(encoding)
+        for encoding in encodings:
+            try:
+                text = data.decode(encoding)
+            except UnicodeDecodeError:
+                continue
+            if encoding in ('ascii', self.encoding_to):
+                return encoding, data
+            try:
+                return encoding, text.encode(self.encoding_to)
+            except UnicodeEncodeError:
+                # fileconv_stream() reports which characters cannot be encoded
+                return None, None
+        return None, None
 
-    def generate_new_path(self, oldpath: str, pathconv=True):
+    def fileconv_bytes(self, data: bytes):
+        """Convert `data` in memory like convpuki_file(); returns the converted bytes and the errors."""
+        _, newdata = self.fileconv_classified(data)
+        if newdata is not None:
+            return newdata, []
+        newfile = io.BytesIO()
+        errors = self.fileconv_stream(io.BytesIO(data), newfile, errors='replace')
+        return newfile.getvalue(), errors
+
+    def describe_errors(self, errors):
+        messages = []
+        for offset, data in errors[:max_reported_errors]:
+            if offset is None:
+                messages.append('{!r} cannot be encoded to {}'.format(data, self.encoding_to))
+            else:
+                messages.append('{} cannot be decoded from {} at offset {}'.format(data, self.encoding_from, offset))
+        if len(errors) > max_reported_errors:
+            messages.append('... and {} more errors'.format(len(errors) - max_reported_errors))
+        return '\n'.join(messages)
+
+    def generate_new_path(self, oldpath: str, pathconv=True, *, names=None):
+        """Generate the output path of `oldpath`.
+
+        `names` is a dict to cache the converted names, because the same page name appears
+        in wiki/, backup/, diff/ and counter/.
+        """
         olddirname = os.path.dirname(oldpath)
         oldbasename = os.path.basename(oldpath)
         oldnoextname, oldextname = os.path.splitext(oldbasename)
+        if names is not None:
+            newnoextname = names.get((oldnoextname, pathconv))
+            if newnoextname is None:
+                newnoextname = names[(oldnoextname, pathconv)] = self.generate_new_name(oldpath, oldnoextname, pathconv)
+        else:
+            newnoextname = self.generate_new_name(oldpath, oldnoextname, pathconv)
+        newdirname = olddirname
+        basedir = self.basedir
+        if newdirname.startswith(basedir):
+            newdirname = newdirname[len(basedir):]
+            if newdirname.startswith(os.sep):
+                newdirname = newdirname[1:]
+        newpath = os.path.join(self.outdir, newdirname, newnoextname + oldextname)
+        return newpath
+
+    def generate_new_name(self, oldpath: str, oldnoextname: str, pathconv=True):
         oldparts = oldnoextname.split('_')
         newnoextname = None
         if pathconv:
@@ -141,19 +656,109 @@ class ConvPuki:
             newnoextname = oldnoextname
         for c in pathbadchars:
             newnoextname = newnoextname.replace(c, '_')
-        newdirname = olddirname
-        basedir = self.basedir
-        if newdirname.startswith(basedir):
-            newdirname = newdirname[len(basedir):]
-            if newdirname.startswith(os.sep):
-                newdirname = newdirname[1:]
-        newpath = os.path.join(self.outdir, newdirname, newnoextname + oldextname)
-        return newpath
+        return newnoextname
 
     def printv(self, *args, **kwargs):
         if self.verbose:
             print(*args, **kwargs)
 
+def glob_to_regex(pattern):
+    # the same as glob.glob(pattern, recursive=True): '**' matches any number of directories,
+    # and wildcards do not match names starting with '.'
+    regex = ''
+    parts = pattern.split('/')
+    for i, part in enumerate(parts):
+        if part == '**':
+            regex += r'(?:[^/.][^/]*/)*'
+            continue
+        if part.startswith(('*', '?')):
+            regex += r'(?!\.)'
+        regex += re.escape(part).replace(r'\*', '[^/]*').replace(r'\?', '[^/]')
+        if i < len(parts) - 1:
+            regex += '/'
+    return regex
+
+def iter_files(path, relpath):
+    """Yield (path, relative path joined with '/') of the files under `path`, skipping hidden ones."""
+    dirs = [(path, relpath)]
+    while dirs:
+        path, relpath = dirs.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                dirs.append((entry.path, relpath + '/' + entry.name))
+            elif entry.is_file():
+                yield entry.path, relpath + '/' + entry.name
+
+def gzip_executor(threads):
+    global _gzip_executor
+    if _gzip_executor is None:
+        _gzip_executor = ThreadPoolExecutor(threads)
+    return _gzip_executor
+
+def compress_gzip_member(data, compresslevel, mtime):
+    # gzip.compress() does not take mtime before Python 3.8
+    buffer = io.BytesIO()
+    with gziplib.GzipFile(fileobj=buffer, mode='wb', compresslevel=compresslevel, mtime=mtime) as file:
+        file.write(data)
+    return buffer.getvalue()
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def copy_mtime(oldpath, newpath):
+    # gitify --update skips backup files which are older than the last run
+    stat = os.stat(oldpath)
+    os.utime(newpath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+def copy_file(oldpath, newpath):
+    # same as shutil.copy2(), but returns the SHA-1 of the content
+    sha1 = hashlib.sha1()
+    with open(oldpath, 'rb') as oldfile, open(newpath, 'wb') as newfile:
+        for chunk in iter(lambda: oldfile.read(chunk_size), b''):
+            sha1.update(chunk)
+            newfile.write(chunk)
+    shutil.copystat(oldpath, newpath)
+    return sha1.hexdigest()
+
+def link_file(oldpath, newpath, mode):
+    """Create `newpath` with the content of `oldpath` without copying it in user space.
+
+    Returns False if `mode` is 'copy' or not supported here (e.g. another file
+    system or an old kernel); then the file must be copied.
+    """
+    if mode == 'copy':
+        return False
+    try:
+        if mode == 'hardlink':
+            os.link(oldpath, newpath)
+            return True
+        with open(oldpath, 'rb') as oldfile, open(newpath, 'wb') as newfile:
+            if mode == 'reflink':
+                import fcntl
+                fcntl.ioctl(newfile.fileno(), FICLONE, oldfile.fileno())
+            else:
+                # os.copy_file_range() is available since Python 3.8
+                size = os.fstat(oldfile.fileno()).st_size
+                while size > 0:
+                    copied = os.copy_file_range(oldfile.fileno(), newfile.fileno(), size)
+                    if copied == 0:
+                        break
+                    size -= copied
+    except (OSError, AttributeError, ImportError):
+        return False
+    shutil.copystat(oldpath, newpath)
+    return True
+
 def main():
     parser = argparse.ArgumentParser(description='PukiWiki encoding converter')
     parser.add_argument('basedir',
@@ -179,6 +784,27 @@ def main():
     # ref.) http://qiita.com/knaka/items/48e1799b56d520af6a09
     parser.add_argument('-u', '--normalization', default='NFC',
                         help='unicode normalization mode for file paths: NFC (default), NFD, NFKC or NFKD')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to convert files (default: 1)')
+    parser.add_argument('-F', '--full', dest='full', action='store_true', default=False,
+                        help='convert all files even if they have not been changed since the last run')
+    parser.add_argument('-L', '--link', dest='link_mode', default='copy',
+                        help='how to output files which are not converted (e.g. attach): '
+                             'copy (default), hardlink, reflink or copy_file_range; falls back to copy if not supported')
+    parser.add_argument('--fallback', dest='fallback_encodings', metavar='ENCODINGS',
+                        type=lambda s: [e for e in s.split(',') if e],
+                        help='comma-separated encodings tried when a file cannot be decoded from <encoding_from> '
+                             '(default: none)')
+    parser.add_argument('--prefer-utf8', dest='prefer_utf8', action='store_true', default=False,
+                        help='try UTF-8 before <encoding_from> for every file, for wikis which have pages '
+                             'in both encodings (e.g. UTF-8 pages with only Latin letters)')
+    parser.add_argument('--compresslevel', type=int, default=9,
+                        help='compression level of the gzipped backup files: 0-9 (default: 9)')
+    parser.add_argument('--gzip-threads', dest='gzip_threads', type=int, default=1,
+                        help='number of threads to compress each gzipped backup file; more than 1 writes '
+                             'multi-member gzip files (default: 1)')
+    parser.add_argument('--stats', dest='stats_path', metavar='FILE',
+                        help='show the progress and write the timings and counters of each phase to FILE as JSON')
     params = parser.parse_args()
 
     convpuki = ConvPuki(**vars(params))
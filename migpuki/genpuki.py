@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# requirements: Python 3.5
+
+import argparse
+import codecs
+import gzip
+import json
+import os
+import os.path
+import random
+import sys
+from datetime import datetime
+
+hiragana = ''.join(chr(c) for c in range(ord('ぁ'), ord('ん') + 1))
+kanji = '日本語文字変換移行履歴差分添付更新削除名前記事会議資料予定開発運用設定手順'
+ascii_words = ['PukiWiki', 'git', 'backup', 'diff', 'http://example.com/', 'TODO', 'FIXME', '#comment', '[[FrontPage]]']
+weekdays = '月火水木金土日'
+# bytes which cannot be decoded as EUC-JP
+invalid_sequences = [b'\xff', b'\x8e\xff', b'\xa1', b'\xfe\x20']
+renamelog_page = ':RenameLog'
+
+class GenPuki:
+    """Generate a synthetic PukiWiki data tree (wiki, backup, diff, counter, cache and attach)."""
+
+    def __init__(self, outdir, *,
+                 verbose=False, pages=1000, revisions=10, page_size=2048, invalid_ratio=0.01, gzip_ratio=0.5,
+                 renames=10, attachments=100, attachment_size=16 * 1024, start=1262304000, seed=0):
+        self.outdir = outdir
+        self.verbose = verbose
+        self.pages = pages
+        self.revisions = revisions
+        self.page_size = page_size
+        self.invalid_ratio = invalid_ratio
+        self.gzip_ratio = gzip_ratio
+        self.renames = renames
+        self.attachments = attachments
+        self.attachment_size = attachment_size
+        self.start = start
+        self.seed = seed
+        self.validate()
+
+    def validate(self):
+        if self.pages < 1:
+            raise ValueError('invalid number of pages: ' + str(self.pages))
+        if self.revisions < 1:
+            raise ValueError('invalid number of revisions: ' + str(self.revisions))
+        if self.renames > self.pages:
+            raise ValueError('number of renames must not exceed number of pages')
+        for name in ['invalid_ratio', 'gzip_ratio']:
+            if not 0 <= getattr(self, name) <= 1:
+                raise ValueError('{} must be between 0 and 1'.format(name))
+
+    def run(self):
+        if os.path.exists(self.outdir):
+            print('output directory \'{}\' already exists.'.format(self.outdir), file=sys.stderr)
+            exit(1)
+        for name in ['wiki', 'backup', 'diff', 'counter', 'cache', 'attach']:
+            os.makedirs(os.path.join(self.outdir, name))
+        self.random = random.Random(self.seed)
+        self.stats = {'pages': 0, 'revisions': 0, 'renames': 0, 'attachments': 0, 'files': 0, 'bytes': 0}
+        recents = []
+        renamelog = []
+        renamed = set(self.random.sample(range(self.pages), self.renames))
+        for i in range(self.pages):
+            page = self.generate_page_name(i)
+            unixtimes = self.generate_unixtimes()
+            bodies = [self.generate_body(page) for _ in unixtimes]
+            # PukiWiki keeps the previous revisions in the backup file and the latest one in wiki/
+            if len(bodies) > 1:
+                self.write_backup(page, unixtimes[:-1], bodies[:-1])
+            self.write_file(self.page_path('wiki', page, '.txt'), bodies[-1], unixtimes[-1])
+            self.write_file(self.page_path('diff', page, '.txt'), self.generate_diff(bodies), unixtimes[-1])
+            counter = '{}\n{}\n0\n0\n127.0.0.1\n'.format(self.random.randrange(1, 10000),
+                                                         datetime.fromtimestamp(unixtimes[-1]).strftime('%Y/%m/%d'))
+            self.write_file(self.page_path('counter', page, '.count'), counter.encode('ascii'), unixtimes[-1])
+            recents.append((unixtimes[-1], page))
+            if i in renamed:
+                # the page was renamed from another name between its revisions
+                unixtime = unixtimes[0] + 1 if len(unixtimes) == 1 else self.random.randrange(unixtimes[0], unixtimes[-1])
+                renamelog.append((unixtime, 'Old' + page, page))
+                self.stats['renames'] += 1
+            if i < self.attachments:
+                self.write_attachment(page, 'file{}.bin'.format(i), unixtimes[-1])
+            self.stats['pages'] += 1
+            self.stats['revisions'] += len(unixtimes)
+            self.printv('[page]: {} ({} revisions)'.format(page, len(unixtimes)))
+        last = max(unixtime for unixtime, _ in recents)
+        if renamelog:
+            renamelog.sort()
+            self.write_file(self.page_path('wiki', renamelog_page, '.txt'), self.generate_renamelog(renamelog), last)
+        recents.sort(reverse=True)
+        recentdat = ''.join('{}\t{}\n'.format(unixtime, page) for unixtime, page in recents)
+        self.write_file(os.path.join(self.outdir, 'cache', 'recent.dat'), recentdat.encode('euc_jp'), last)
+        return self.stats
+
+    def generate_page_name(self, i):
+        kind = i % 4
+        if kind == 0:
+            return 'Page{}'.format(i)
+        if kind == 1:
+            return 'ページ{}'.format(i)
+        if kind == 2:
+            return '{}/Sub{}'.format(self.random.choice(['会議', 'Project', '資料']), i)
+        return '{}{}'.format(''.join(self.random.choice(kanji) for _ in range(3)), i)
+
+    def generate_unixtimes(self):
+        unixtime = self.start + self.random.randrange(0, 365 * 86400)
+        unixtimes = []
+        for _ in range(self.random.randint(max(1, self.revisions // 2), self.revisions * 3 // 2 or 1)):
+            unixtime += self.random.randrange(60, 30 * 86400)
+            unixtimes.append(unixtime)
+        return unixtimes
+
+    def generate_body(self, page):
+        lines = ['* ' + page]
+        size = len(lines[0]) * 2
+        while size < self.page_size:
+            kind = self.random.random()
+            if kind < 0.4:
+                line = ''.join(self.random.choice(hiragana) for _ in range(self.random.randint(10, 40)))
+            elif kind < 0.7:
+                line = ''.join(self.random.choice(kanji + hiragana) for _ in range(self.random.randint(10, 40)))
+            else:
+                line = ' '.join(self.random.choice(ascii_words) for _ in range(self.random.randint(3, 10)))
+            lines.append(line)
+            size += len(line) * 2 + 1
+        body = ('\n'.join(lines) + '\n').encode('euc_jp')
+        if self.random.random() < self.invalid_ratio:
+            pos = body.rfind(b'\n', 0, self.random.randrange(len(body))) + 1
+            body = body[:pos] + self.random.choice(invalid_sequences) + b'\n' + body[pos:]
+        return body
+
+    def generate_diff(self, bodies):
+        old = bodies[-2].splitlines() if len(bodies) > 1 else []
+        new = bodies[-1].splitlines()
+        return b''.join(b'-' + line + b'\n' for line in old) + b''.join(b'+' + line + b'\n' for line in new)
+
+    def generate_renamelog(self, renamelog):
+        lines = []
+        for unixtime, old, new in renamelog:
+            date = datetime.fromtimestamp(unixtime)
+            lines.append(date.strftime('*%Y-%m-%d ({}) %H:%M:%S').format(weekdays[date.weekday()]))
+            lines.append('-{}→{}'.format(old, new))
+        return ('\n'.join(lines) + '\n').encode('euc_jp')
+
+    def write_backup(self, page, unixtimes, bodies):
+        data = b''.join(b'>>>>>>>>>> ' + str(unixtime).encode('ascii') + b'\n' + body
+                        for unixtime, body in zip(unixtimes, bodies))
+        if self.random.random() < self.gzip_ratio:
+            self.write_file(self.page_path('backup', page, '.gz'), gzip.compress(data), unixtimes[-1])
+        else:
+            self.write_file(self.page_path('backup', page, '.txt'), data, unixtimes[-1])
+
+    def write_attachment(self, page, filename, unixtime):
+        path = os.path.join(self.outdir, 'attach', encode_name(page) + '_' + encode_name(filename))
+        size = self.attachment_size
+        data = self.random.getrandbits(size * 8).to_bytes(size, 'little') if size else b''
+        self.write_file(path, data, unixtime)
+        # the attach plugin keeps the download count in the log file
+        self.write_file(path + '.log', '{}\n'.format(self.random.randrange(100)).encode('ascii'), unixtime)
+        self.stats['attachments'] += 1
+
+    def write_file(self, path, data, unixtime):
+        with open(path, 'wb') as file:
+            file.write(data)
+        os.utime(path, (unixtime, unixtime))
+        self.stats['files'] += 1
+        self.stats['bytes'] += len(data)
+
+    def page_path(self, dirname, page, extname):
+        return os.path.join(self.outdir, dirname, encode_name(page) + extname)
+
+    def printv(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+def encode_name(name):
+    # PukiWiki stores page names as upper-case hex of EUC-JP
+    return codecs.decode(codecs.encode(name.encode('euc_jp'), 'hex'), 'ascii').upper()
+
+def main():
+    parser = argparse.ArgumentParser(description='generate synthetic PukiWiki data for benchmarks')
+    parser.add_argument('outdir',
+                        help='output directory name (which will have wiki, backup and cache directories)')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                        help='show verbose log')
+    parser.add_argument('-N', '--pages', type=int, default=1000,
+                        help='number of pages (default: 1000)')
+    parser.add_argument('-R', '--revisions', type=int, default=10,
+                        help='average number of revisions per page (default: 10)')
+    parser.add_argument('-S', '--page-size', dest='page_size', type=int, default=2048,
+                        help='approximate size of a revision in bytes (default: 2048)')
+    parser.add_argument('--invalid-ratio', dest='invalid_ratio', type=float, default=0.01,
+                        help='ratio of revisions which have invalid EUC-JP bytes (default: 0.01)')
+    parser.add_argument('--gzip-ratio', dest='gzip_ratio', type=float, default=0.5,
+                        help='ratio of gzipped backup files (default: 0.5)')
+    parser.add_argument('--renames', type=int, default=10,
+                        help='number of renamed pages written to :RenameLog (default: 10)')
+    parser.add_argument('--attachments', type=int, default=100,
+                        help='number of attached files (default: 100)')
+    parser.add_argument('--attachment-size', dest='attachment_size', type=int, default=16 * 1024,
+                        help='size of an attached file in bytes (default: 16384)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    params = parser.parse_args()
+
+    genpuki = GenPuki(**vars(params))
+    stats = genpuki.run()
+    print(json.dumps(stats, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
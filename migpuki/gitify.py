@@ -4,24 +4,523 @@
 import argparse
 import glob
 import gzip
+import hashlib
+import heapq
+import json
+import mmap
 import os
 import os.path
+import pickle
 import re
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import time
+import traceback
+from bisect import bisect_left
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 
+if __package__:
+    from .convpuki import ConvPuki, default_confs
+    from .revindex import RevisionIndex
+    from .stats import Stats
+else:
+    from convpuki import ConvPuki, default_confs
+    from revindex import RevisionIndex
+    from stats import Stats
+
 Commit = namedtuple('Commit', ['unixtime', 'path', 'data'])
 Rename = namedtuple('Rename', ['unixtime', 'oldpath', 'newpath'])
-unixtime_re = re.compile(r'\s*\>{10}\s+(\d+)\s*')
+Attachment = namedtuple('Attachment', ['unixtime', 'path', 'oldpath'])
+separator_re = re.compile(rb'^[ \t\r\f\v]*>{10}[ \t\r\f\v]+(\d+)[^\n]*(?:\n|$)', re.M)
 renamelog_date_re = re.compile(r'\s*\*(\d+)-(\d+)-(\d+)\s*\(.+?\)\s*(\d+):(\d+):(\d+)\s*')
 renamelog_change_re = re.compile(r'^-([^\-].*?)→(.+)$')
+attach_age_re = re.compile(r'\.(\d+)$')
+ident_re = re.compile(r'^(.*<.*>)\s+\d+\s+[+\-]\d{4}$')
+valid_backends = {'fast-import', 'subprocess'}
+state_ref = 'refs/migpuki/state'
+
+class GitFastImport:
+    """Feed commits to a single long-lived `git fast-import` process.
+
+    The tree of the branch is tracked in memory (path -> blob SHA-1) so that
+    no-op changes are skipped the same way as `git diff-index --quiet` does
+    in the subprocess backend, and identical blobs are sent only once.
+    """
+
+    def __init__(self, ref, ident, *, parent=None, tree=None):
+        self.ref = ref
+        self.ident = ident
+        self.parent = parent  # commit to continue from (incremental import)
+        self.tree = tree or {}  # {path: blob sha1}
+        self.marks = {}    # {blob sha1: mark}
+        self.changes = []  # [bytes]
+        self.last_mark = 0
+        self.nblobs = 0
+        self.nbytes = 0
+        self.proc = subprocess.Popen(['git', 'fast-import', '--quiet', '--done'], stdin=subprocess.PIPE)
+
+    def write(self, *chunks):
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode('utf-8')
+            self.proc.stdin.write(chunk)
+
+    def blob(self, sha1, load):
+        mark = self.marks.get(sha1)
+        if mark is None:
+            data = load()
+            mark = self.new_mark(sha1, len(data))
+            self.write(data, '\n')
+        return mark
+
+    def new_mark(self, sha1, size):
+        # the header of a new blob; its content of `size` bytes must follow
+        self.last_mark += 1
+        mark = ':{}'.format(self.last_mark)
+        self.write('blob\nmark {}\ndata {}\n'.format(mark, size))
+        self.marks[sha1] = mark
+        self.nblobs += 1
+        self.nbytes += size
+        return mark
+
+    def write_file(self, path, data: bytes):
+        return self.write_blob(path, git_blob_sha1(data), lambda: data)
+
+    def write_blob(self, path, sha1, load):
+        # `load` is called only when the blob has not been sent yet
+        if self.tree.get(path) == sha1:
+            return False
+        mark = self.blob(sha1, load)
+        self.tree[path] = sha1
+        self.changes.append(b'M 100644 ' + mark.encode('ascii') + b' ' + quote_path(path) + b'\n')
+        return True
+
+    def write_blob_file(self, path, sha1, oldpath, size):
+        # same as write_blob(), but streams the file (e.g. a large attachment) without loading it
+        if self.tree.get(path) == sha1:
+            return False
+        mark = self.marks.get(sha1)
+        if mark is None:
+            mark = self.new_mark(sha1, size)
+            with open(oldpath, 'rb') as oldfile:
+                shutil.copyfileobj(oldfile, self.proc.stdin, 1024 * 1024)
+            self.write('\n')
+        self.tree[path] = sha1
+        self.changes.append(b'M 100644 ' + mark.encode('ascii') + b' ' + quote_path(path) + b'\n')
+        return True
+
+    def delete_file(self, path):
+        if path not in self.tree:
+            return False
+        del self.tree[path]
+        self.changes.append(b'D ' + quote_path(path) + b'\n')
+        return True
+
+    def rename_file(self, oldpath, newpath):
+        if oldpath not in self.tree or oldpath == newpath:
+            return False
+        self.tree[newpath] = self.tree.pop(oldpath)
+        self.changes.append(b'R ' + quote_path(oldpath) + b' ' + quote_path(newpath) + b'\n')
+        return True
+
+    def commit(self, unixtime, message, *, tz='+0000'):
+        if not self.changes:
+            return False
+        message = message.encode('utf-8')
+        signature = '{} {} {}\n'.format(self.ident, int(unixtime), tz)
+        self.write('commit {}\n'.format(self.ref),
+                   'author ' + signature, 'committer ' + signature,
+                   'data {}\n'.format(len(message)), message, '\n')
+        if self.parent:
+            self.write('from {}\n'.format(self.parent))
+            self.parent = None
+        self.write(*self.changes)
+        self.write('\n')
+        self.changes = []
+        return True
+
+    def close(self):
+        self.write('done\n')
+        self.proc.stdin.close()
+        returncode = self.proc.wait()
+        if returncode != 0:
+            raise Exception('failed: git fast-import, return code: {}'.format(returncode))
+
+class SourceReader:
+    """Read a file of the original PukiWiki tree, converted in memory by ConvPuki (direct mode)."""
+
+    def __init__(self, converter):
+        self.converter = converter
+
+    def __call__(self, oldpath, gz=False):
+        openf = gzip.open if gz else open
+        with openf(oldpath, 'rb') as oldfile:
+            data = oldfile.read()
+        data, errors = self.converter.fileconv_bytes(data)
+        if errors:
+            print('[warning]: {}\n{}'.format(oldpath, self.converter.describe_errors(errors)), file=sys.stderr)
+        return data
+
+class Blob:
+    """Location of a revision body in a backup file, and in a spool file if it was spooled."""
+    __slots__ = ('sha1', 'file_id', 'offset', 'length', 'spool_offset', 'spool_id')
+
+    def __init__(self, sha1, file_id, offset, length, spool_offset=None, spool_id=0):
+        self.sha1 = sha1
+        self.file_id = file_id
+        self.offset = offset
+        self.length = length
+        self.spool_offset = spool_offset
+        self.spool_id = spool_id
+
+class RevisionStore:
+    """Compact, offset-based store of backup revisions.
+
+    Backup files are scanned once for `>>>>>>>>>> <unixtime>` separators and
+    only the location of each body is kept, so the text is read only when the
+    git writer needs it. Identical bodies (rollbacks, templates, ...) share a
+    single Blob. Plain text backups are scanned through mmap and referenced in
+    place; bodies of gzipped backups are decompressed once and appended to a
+    spool file in `tmpdir`.
+    """
+
+    def __init__(self, tmpdir, name='spool', *, reader=None):
+        self.reader = reader  # SourceReader in direct mode
+        self.sources = []  # [oldpath]
+        self.blobs = {}    # {sha1: Blob}
+        self.spool = open(os.path.join(tmpdir, name), 'w+b')
+        self.spool_size = 0
+        self.spools = [self.spool]      # spool files of parse_backup_file() follow
+        self.spool_ids = {self.spool.name: 0}
+
+    def close(self):
+        for spool in self.spools:
+            spool.close()
+
+    def parse_file(self, oldpath, path, gz, *, locations=None):
+        """Return the commits of a backup file; (offset, length, sliced) of each body is appended to `locations`."""
+        file_id = len(self.sources)
+        self.sources.append(oldpath)
+        if self.reader is not None:
+            # the converted file exists only in memory
+            data = self.reader(oldpath, gz)
+            if not gz:
+                data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            return self.parse_buffer(data, path, file_id, spool=True, locations=locations)
+        if gz:
+            with gzip.open(oldpath) as oldfile:
+                return self.parse_buffer(oldfile.read(), path, file_id, spool=True, locations=locations)
+        with open(oldpath, 'rb') as oldfile:
+            if os.fstat(oldfile.fileno()).st_size == 0:
+                return self.parse_buffer(b'', path, file_id, spool=True, locations=locations)
+            with mmap.mmap(oldfile.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return self.parse_buffer(buf, path, file_id, spool=False, locations=locations)
+
+    def parse_buffer(self, buf, path, file_id, *, spool, locations=None):
+        # split at the separator lines (">>>>>>>>>> unixtime") in a single linear scan
+        history = []
+        bodies = []  # [(start, end, preamble)]
+        unixtime = None
+        start = 0
+        preamble = None
+        for match in separator_re.finditer(buf):
+            if unixtime is None:
+                # lines before the first separator belong to the first revision
+                if match.start() > 0:
+                    preamble = buf[:match.start()]
+            else:
+                history.append(Commit(unixtime, path, self.add(buf, file_id, start, match.start(), spool, preamble)))
+                bodies.append((start, match.start(), preamble))
+                preamble = None
+            unixtime = int(match.group(1))
+            start = match.end()
+        if unixtime is None:
+            unixtime = datetime.now(timezone.utc).timestamp()
+        history.append(Commit(unixtime, path, self.add(buf, file_id, start, len(buf), spool, preamble)))
+        bodies.append((start, len(buf), preamble))
+        if locations is not None:
+            for start, end, preamble in bodies:
+                # the same condition as add() to reference the file in place
+                sliced = not spool and preamble is None and buf.find(b'\r', start, end) < 0
+                locations.append((start, end - start, sliced))
+        return history
+
+    def add(self, buf, file_id, start, end, spool, preamble=None):
+        if preamble is not None or (not spool and buf.find(b'\r', start, end) >= 0):
+            # not a plain slice of the file (or needs universal newlines as in text mode)
+            data = (preamble or b'') + buf[start:end]
+            if not spool:
+                data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            return self.add_bytes(data, file_id, start)
+        body = memoryview(buf)[start:end]
+        try:
+            sha1 = git_blob_sha1(body)
+            blob = self.blobs.get(sha1)
+            if blob is None:
+                if spool:
+                    blob = self.spool_bytes(sha1, body, file_id, start)
+                else:
+                    blob = Blob(sha1, file_id, start, end - start)
+                self.blobs[sha1] = blob
+            return blob
+        finally:
+            body.release()
+
+    def add_bytes(self, data: bytes, file_id=None, offset=0):
+        sha1 = git_blob_sha1(data)
+        blob = self.blobs.get(sha1)
+        if blob is None:
+            blob = self.spool_bytes(sha1, data, file_id, offset)
+            self.blobs[sha1] = blob
+        return blob
+
+    def spool_bytes(self, sha1, data, file_id, offset):
+        self.spool.seek(self.spool_size)
+        self.spool.write(data)
+        blob = Blob(sha1, file_id, offset, len(data), spool_offset=self.spool_size)
+        self.spool_size += len(data)
+        return blob
+
+    def add_parsed(self, oldpath, path, spool_path, records):
+        """Add the records returned by parse_backup_file() in a worker process."""
+        file_id = len(self.sources)
+        self.sources.append(oldpath)
+        spool_id = self.spool_ids.get(spool_path)
+        if spool_id is None:
+            spool_id = self.spool_ids[spool_path] = len(self.spools)
+            self.spools.append(open(spool_path, 'rb'))
+        history = []
+        for unixtime, sha1, offset, length, spool_offset in records:
+            blob = self.blobs.get(sha1)
+            if blob is None:
+                blob = Blob(sha1, file_id, offset, length, spool_offset, spool_id)
+                self.blobs[sha1] = blob
+            history.append(Commit(unixtime, path, blob))
+        return history
+
+    def add_indexed(self, oldpath, path, revisions):
+        """Add the sliced revisions of a plain backup file read from RevisionIndex, without reading the file."""
+        file_id = len(self.sources)
+        self.sources.append(oldpath)
+        history = []
+        for revision in revisions:
+            blob = self.blobs.get(revision.sha1)
+            if blob is None:
+                blob = self.blobs[revision.sha1] = Blob(revision.sha1, file_id, revision.offset, revision.length)
+            history.append(Commit(revision.unixtime, path, blob))
+        return history
+
+    def read(self, blob):
+        if blob.spool_offset is not None:
+            spool = self.spools[blob.spool_id]
+            spool.seek(blob.spool_offset)
+            return spool.read(blob.length)
+        with open(self.sources[blob.file_id], 'rb') as file:
+            file.seek(blob.offset)
+            return file.read(blob.length)
+
+_parse_store = None
+
+def parse_backup_file(args):
+    """Parse a backup file in a worker process.
+
+    Returns the path of the spool file of this process, the records of the
+    revisions, which are deduplicated by RevisionStore.add_parsed(), and the
+    locations of the bodies for RevisionIndex (None if `locate` is false).
+    """
+    global _parse_store
+    tmpdir, oldpath, path, gz, reader, locate = args
+    if _parse_store is None:
+        _parse_store = RevisionStore(tmpdir, 'spool-{}'.format(os.getpid()))
+    _parse_store.reader = reader
+    _parse_store.sources = []
+    _parse_store.blobs = {}
+    locations = [] if locate else None
+    try:
+        history = _parse_store.parse_file(oldpath, path, gz, locations=locations)
+    except Exception as e:
+        print('[error]: {}'.format(oldpath), file=sys.stderr)
+        raise e
+    _parse_store.spool.flush()
+    records = [(c.unixtime, c.data.sha1, c.data.offset, c.data.length, c.data.spool_offset) for c in history]
+    return _parse_store.spool.name, records, locations
+
+def hash_source_file(args):
+    # git blob SHA-1 of a source file as gitify writes it (converted in memory in direct mode)
+    oldpath, reader = args
+    if reader is not None:
+        return git_blob_sha1(reader(oldpath))
+    return git_blob_sha1_file(oldpath, os.stat(oldpath).st_size)
+
+def read_rename_file(args):
+    path, reader = args
+    if reader is not None:
+        return parse_rename_log(reader(path, path.endswith('.gz')).splitlines())
+    openf = gzip.open if path.endswith('.gz') else open
+    with openf(path) as file:
+        return parse_rename_log(file)
+
+def parse_rename_log(file):
+    # renames in the order of the log
+    history = []
+    unixtime = None
+    for line in file:
+        if hasattr(line, 'decode'):
+            line = line.decode('utf-8')
+        line = line.strip()
+        match = renamelog_date_re.match(line)
+        if match:
+            y, mo, d, h, mi, s = map(int, match.groups())
+            unixtime = int(datetime(y, mo, d, h, mi, s, 0).timestamp())
+            continue
+        match = renamelog_change_re.match(line)
+        if match:
+            page_from = match.group(1)
+            page_to = match.group(2)
+            history.append(Rename(unixtime, page_from + '.txt', page_to + '.txt'))
+            continue
+    return history
+
+class RenameIndex:
+    """Resolve the path which a page had at a given point of the history.
+
+    Backup files are named after the latest page name, so a commit read from
+    them must be moved back along the rename chain (A → B → C) to the name
+    the page had at that time. Each step only looks at renames older than the
+    previous one, so cycles (A → B → A) terminate.
+    """
+
+    def __init__(self, renames):
+        self.renames = {}  # {newpath: ([seq], [Rename])}
+        for seq, rename in enumerate(sorted(renames, key=history_key)):
+            seqs, items = self.renames.setdefault(rename.newpath, ([], []))
+            seqs.append(seq)
+            items.append(rename)
+
+    def resolve(self, path, unixtime):
+        # follow the renames done at or after `unixtime`, newest first
+        upper = None
+        while path in self.renames:
+            seqs, items = self.renames[path]
+            i = len(seqs) if upper is None else bisect_left(seqs, upper)
+            if i == 0 or items[i - 1].unixtime < unixtime:
+                break
+            upper = seqs[i - 1]
+            path = items[i - 1].oldpath
+        return path
+
+class WatchState:
+    """What `gitify --watch` keeps in memory between polls instead of scanning the source tree again."""
+
+    def __init__(self):
+        self.files = {}        # {oldpath: (st_size, st_mtime_ns)} of the pages and backup files
+        self.dirs = {}         # {dirpath: (st_mtime_ns, {entry name})} of the watched directories
+        self.recent_mtime = None
+        self.recents = {}      # {page name: unixtime} in recent.dat
+        self.pages = {}        # {path in git repo: oldpath} of the latest pages
+        self.names = {}        # page names decoded by ConvPuki.generate_new_path() (direct mode)
+        self.tree = None       # {path: blob sha1} of the branch after the last fast-import
+        # changes found by the last poll
+        self.changed_pages = set()
+        self.backup_files = {}  # {oldpath: (oldpath, path, gz)}
+        self.attachments_changed = False
+
+    def has_changes(self):
+        return bool(self.changed_pages or self.backup_files or self.attachments_changed)
+
+    def clear_changes(self):
+        self.changed_pages = set()
+        self.backup_files = {}
+        self.attachments_changed = False
+
+def history_key(item):
+    """Sort key of the history: (unixtime, kind), commits before renames at the same time.
+
+    Items with the same key keep the order in which they were read (backup files
+    in the order of page names, then recent.dat, then the rename log), because
+    list.sort() and heapq.merge() are stable. So the order is (unixtime, kind, sequence)
+    without comparing page names or bodies.
+    """
+    return (item.unixtime, 1 if type(item) == Rename else 0)
+
+def merge_sorted(sources, key, fanin, tmpdir):
+    """Merge sorted iterables lazily, spilling into `tmpdir` when there are more than `fanin` of them.
+
+    `sources` are callables returning iterables so that only `fanin` of them are opened at once.
+    """
+    sources = list(sources)
+    while len(sources) > fanin:
+        runs = []
+        for i in range(0, len(sources), fanin):
+            with tempfile.NamedTemporaryFile(dir=tmpdir, delete=False) as run:
+                for item in heapq.merge(*[source() for source in sources[i:i + fanin]], key=key):
+                    pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+            runs.append(run.name)
+        sources = [lambda run=run: iter_pickled(run) for run in runs]
+    return heapq.merge(*[source() for source in sources], key=key)
+
+def iter_pickled(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                yield pickle.load(file)
+            except EOFError:
+                break
+    os.remove(path)
+
+def git_blob_sha1(data):
+    sha1 = hashlib.sha1('blob {}\0'.format(len(data)).encode('ascii'))
+    sha1.update(data)
+    return sha1.hexdigest()
+
+def git_blob_sha1_file(path, size):
+    sha1 = hashlib.sha1('blob {}\0'.format(size).encode('ascii'))
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def encode_page_name(name, encoding):
+    # PukiWiki names the files of a page in upper-case hex
+    return name.encode(encoding).hex().upper()
+
+def stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def parse_date(value):
+    if value.isdigit():
+        return int(value)
+    for format in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']:
+        try:
+            return int(datetime.strptime(value, format).timestamp())
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('invalid date: ' + value)
+
+def quote_path(path):
+    # ref.) "Paths" in git-fast-import(1)
+    path = path.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return b'"' + os.fsencode(path) + b'"'
+
+def local_timezone():
+    offset = time.localtime().tm_gmtoff // 60
+    sign = '-' if offset < 0 else '+'
+    return '{}{:02d}{:02d}'.format(sign, abs(offset) // 60, abs(offset) % 60)
 
 class Gitify:
     def __init__(self, basedir, *, verbose=False, outdir='wiki-repo', directcontents=False,
-                 name=None, email=None, renamelog=False):
+                 name=None, email=None, renamelog=False, backend='fast-import',
+                 streaming=False, max_open_files=256, update=False, jobs=1,
+                 stats_path=None, direct=False, encoding_from='euc_jp', normalization='NFC', attachments=False,
+                 index_path=None):
         self.basedir = basedir
         self.basedir_abs = os.path.abspath(self.basedir)
         self.verbose = verbose
@@ -30,180 +529,533 @@ class Gitify:
         self.name = name
         self.email = email
         self.renamelog = renamelog
+        self.backend = backend
+        self.streaming = streaming
+        self.max_open_files = max_open_files
+        self.update = update
+        self.jobs = jobs
+        self.stats = Stats(stats_path)
+        self.direct = direct
+        self.attachments = attachments
+        self.index_path = index_path
+        self.index = None      # RevisionIndex if index_path is given
+        self.converter = None  # ConvPuki in direct mode
+        self.reader = None     # SourceReader in direct mode
+        if self.direct:
+            self.converter = ConvPuki(self.basedir_abs, outdir='', encoding_from=encoding_from,
+                                      normalization=normalization)
+            self.reader = SourceReader(self.converter)
+        if self.backend not in valid_backends:
+            raise ValueError('invalid backend: ' + self.backend)
+        if self.max_open_files < 2:
+            raise ValueError('max_open_files must be at least 2')
+        if self.jobs < 1:
+            raise ValueError('invalid number of jobs: ' + str(self.jobs))
 
         self.commit_history = []     # [Commit]
-        self.rename_history = set()  # {Rename}
+        self.rename_history = []     # [Rename] (without duplicates)
+        self.attachment_history = [] # [Attachment]
+        self.attachment_sha1s = {}   # {(st_dev, st_ino, st_size, st_mtime_ns): blob sha1}
         self.all_history = []        # [Commit | Rename]
+        self.store = None            # RevisionStore
+        self.tmpdir = None
+        self.since = None            # unixtime of the last migrated item (update mode)
+        self.last_unixtime = None
+        self.touched_paths = set()   # paths in git repo changed by this run
+        self.watching = None         # WatchState while watch() is running
         self._debug_count = 0
 
     def run(self):
         if os.path.exists(self.outdir):
-            print('output directory \'{}\' already exists.'.format(self.outdir), file=sys.stderr)
-            exit(1)
+            if not self.update:
+                print('output directory \'{}\' already exists.'.format(self.outdir), file=sys.stderr)
+                exit(1)
+            self.since = self.read_state()
+            self.last_unixtime = self.since
+            print('* updating git repo since {}...'.format(datetime.utcfromtimestamp(self.since).isoformat() + 'Z'))
+        self.migrate()
+
+    def migrate(self):
+        if self.index_path:
+            self.index = RevisionIndex(self.index_path, self.index_options())
+        succeeded = False
+        with tempfile.TemporaryDirectory(prefix='gitify-') as self.tmpdir:
+            self.store = RevisionStore(self.tmpdir, reader=self.reader)
+            try:
+                self.generate()
+                succeeded = True
+            finally:
+                self.store.close()
+                if self.index:
+                    self.index.close(commit=succeeded)
+        self.stats.count('blobs', len(self.store.blobs))
+        self.stats.write()
+
+    def generate(self):
         self.commit_history = []
+        self.rename_history = []
+        self.attachment_history = []
+        # while watching, attachments are read again only if their directories have been changed
+        attachments = self.attachments and (self.watching is None or self.watching.attachments_changed)
+        if self.streaming:
+            if self.renamelog:
+                print('* reading pukiwiki rename log...')
+                with self.stats.phase('read rename log'):
+                    self.generate_rename_history()
+            if attachments:
+                print('* reading pukiwiki attachments...')
+                with self.stats.phase('read attachments'):
+                    self.generate_attachment_history()
+            print('* generating git repo (streaming)...')
+            self.all_history = self.iter_all_history()
+            self.generate_git_repository()
+            return
         print('* reading pukiwiki data...')
-        self.generate_commit_history()
-        self.generate_recent_commit_history()
-        self.rename_history = set()
+        with self.stats.phase('read backups'):
+            self.generate_commit_history()
+        with self.stats.phase('read recent.dat'):
+            self.generate_recent_commit_history()
         if self.renamelog:
-            self.generate_rename_history()
+            with self.stats.phase('read rename log'):
+                self.generate_rename_history()
+        if attachments:
+            with self.stats.phase('read attachments'):
+                self.generate_attachment_history()
         print('* creating new history...')
-        self.all_history = self.commit_history + list(self.rename_history)
-        self.all_history.sort()
+        with self.stats.phase('sort history'):
+            self.all_history = self.commit_history + self.attachment_history + self.rename_history
+            self.all_history.sort(key=history_key)
         if self.renamelog:
-            self.rename_paths_in_all_history()
+            with self.stats.phase('rename paths'):
+                self.rename_paths_in_all_history()
         print('* generating git repo...')
         self.generate_git_repository()
 
+    def iter_all_history(self):
+        # each backup file is already sorted by time, so merge them lazily instead of sorting everything
+        if self.jobs > 1:
+            sources = [lambda c=c: iter(c) for c in self.parse_backup_files(self.iter_backup_files())]
+        else:
+            sources = [lambda s=s: self.iter_backup_commit_history(*s) for s in self.iter_backup_files()]
+        sources.append(self.iter_recent_commit_history)
+        renames = sorted(self.rename_history, key=history_key)
+        index = RenameIndex(renames)
+        commits = merge_sorted(sources, history_key, self.max_open_files, self.tmpdir)
+        commits = (Commit(c.unixtime, index.resolve(c.path, c.unixtime), c.data) for c in commits)
+        attachments = sorted(self.attachment_history, key=history_key)
+        yield from heapq.merge(commits, attachments, renames, key=history_key)
+
     def generate_commit_history(self):
-        pattern = os.path.join(self.basedir, 'backup/**/*.txt')
-        prefixlen = len(os.path.join(self.basedir, 'backup') + os.sep)
-        for oldpath in glob.iglob(pattern, recursive=True):
-            path = oldpath[prefixlen:]
-            if path == '_RenameLog.txt':
-                continue
-            with open(oldpath) as oldfile:
-                self.read_and_extend_commit_history(oldfile, path)
-            if self._debug_count and len(self.commit_history) > self._debug_count / 2:
+        for commits in self.parse_backup_files(self.iter_backup_files()):
+            self.commit_history.extend(commits)
+            if self._debug_count and len(self.commit_history) > self._debug_count:
                 break
-        pattern = os.path.join(self.basedir, 'backup/**/*.gz')
-        for oldpath in glob.iglob(pattern, recursive=True):
-            path = oldpath[prefixlen:-3] + '.txt'
-            if path == '_RenameLog.txt':
+
+    def parse_backup_files(self, files):
+        """Yield the new commits of each backup file in the order of `files`, parsing them on `jobs` processes."""
+        if self.jobs == 1:
+            for oldpath, path, gz in files:
+                try:
+                    yield list(self.iter_backup_commit_history(oldpath, path, gz))
+                except Exception as e:
+                    print('[error]: {}'.format(oldpath), file=sys.stderr)
+                    raise e
+            return
+        files = list(files)
+        indexed = [self.read_indexed_revisions(oldpath, gz) for oldpath, _, gz in files]
+        results = self.map_jobs(parse_backup_file, [(self.tmpdir,) + file + (self.reader, self.index is not None)
+                                                    for file, revisions in zip(files, indexed) if revisions is None])
+        for (oldpath, path, gz), revisions in zip(files, indexed):
+            if revisions is not None:
+                history = self.store.add_indexed(oldpath, path, revisions)
+            else:
+                spool_path, records, locations = next(results)
+                history = self.store.add_parsed(oldpath, path, spool_path, records)
+                self.index_revisions(oldpath, history, locations)
+            yield [commit for commit in history if self.is_new(commit)]
+
+    def map_jobs(self, func, items):
+        # same as map(), but on `jobs` processes
+        if self.jobs == 1:
+            yield from map(func, items)
+            return
+        items = list(items)
+        chunksize = max(1, min(64, len(items) // (self.jobs * 4)))
+        with ProcessPoolExecutor(self.jobs) as executor:
+            yield from executor.map(func, items, chunksize=chunksize)
+
+    def generate_recent_commit_history(self):
+        self.commit_history.extend(self.iter_recent_commit_history())
+
+    def iter_source_files(self, dirname, ext):
+        """Yield (path of a source file, path relative to `dirname` in the converted tree)."""
+        if self.converter is None:
+            prefixlen = len(os.path.join(self.basedir_abs, dirname) + os.sep)
+            pattern = os.path.join(self.basedir_abs, dirname, '**/*' + ext)
+            for oldpath in glob.iglob(pattern, recursive=True):
+                yield oldpath, oldpath[prefixlen:]
+            return
+        # direct mode: the same files and names as convpuki would write
+        confs = [conf for conf in default_confs if conf.pattern == dirname + '/**/*' + ext]
+        prefixlen = len(dirname + os.sep)
+        for tasks in self.converter.scan_tasks(confs):
+            for task in tasks:
+                yield task.oldpath, task.newpath[prefixlen:]
+
+    def read_source(self, oldpath):
+        if self.reader is not None:
+            return self.reader(oldpath)
+        with open(oldpath, 'rb') as oldfile:
+            return oldfile.read()
+
+    def iter_backup_files(self):
+        if self.watching is not None:
+            # only the backup files changed since the last poll
+            files = list(self.watching.backup_files.values())
+        else:
+            files = []
+            for ext, gz in [('txt', False), ('gz', True)]:
+                for oldpath, path in self.iter_source_files('backup', '.' + ext):
+                    path = path[:-len(ext)] + 'txt'
+                    if path == '_RenameLog.txt':
+                        continue
+                    files.append((oldpath, path, gz))
+        # in the order of page names, which decides the order of commits at the same time (see history_key())
+        files.sort(key=lambda file: file[1])
+        for oldpath, path, gz in files:
+            stat = os.stat(oldpath)
+            # a backup file has no revisions newer than itself
+            if self.since is not None and stat.st_mtime <= self.since:
                 continue
+            self.stats.count('backup_files')
+            self.stats.count('bytes_read', stat.st_size)
+            yield oldpath, path, gz
+
+    def iter_backup_commit_history(self, oldpath, path, gz):
+        revisions = self.read_indexed_revisions(oldpath, gz)
+        if revisions is not None:
+            history = self.store.add_indexed(oldpath, path, revisions)
+        else:
+            locations = [] if self.index else None
+            history = self.store.parse_file(oldpath, path, gz, locations=locations)
+            self.index_revisions(oldpath, history, locations)
+        for commit in history:
+            if self.is_new(commit):
+                yield commit
+
+    def index_options(self):
+        # the offsets in the index depend on how the source files are read
+        options = {'direct': self.direct}
+        if self.converter is not None:
+            options.update(self.converter.manifest_options())
+        return options
+
+    def read_indexed_revisions(self, oldpath, gz, *, sliced=True):
+        # with `sliced`, only the revisions which can be read from the file in place, because the bodies are read
+        # later; the others need parsing anyway (only the SHA-1s are needed to verify them)
+        if self.index is None or (sliced and (gz or self.reader is not None)):
+            return None
+        revisions = self.index.revisions(os.path.relpath(oldpath, self.basedir_abs), os.stat(oldpath))
+        if revisions is None or (sliced and not all(revision.sliced for revision in revisions)):
+            return None
+        self.stats.count('indexed_files')
+        return revisions
+
+    def index_revisions(self, oldpath, history, locations):
+        if self.index is None:
+            return
+        revisions = [(commit.path, commit.unixtime, offset, length, commit.data.sha1, sliced)
+                     for commit, (offset, length, sliced) in zip(history, locations)]
+        self.index.add_revisions(os.path.relpath(oldpath, self.basedir_abs), os.stat(oldpath), revisions)
+
+    def read_recents(self):
+        """Return [(unixtime, page name)] in cache/recent.dat."""
+        recents = []
+        recentdatpath = os.path.join(self.basedir_abs, 'cache/recent.dat')
+        if self.reader is None:
+            with open(recentdatpath) as recentdat:
+                lines = recentdat.read().splitlines()
+        else:
+            lines = self.read_source(recentdatpath).decode('utf-8').splitlines()
+        for line in lines:
+            line = line.strip()
+            parts = line.split('\t')
             try:
-                with gzip.open(oldpath) as oldfile:
-                    self.read_and_extend_commit_history(oldfile, path)
-                if self._debug_count and len(self.commit_history) > self._debug_count:
-                    break
+                unixtime, pagename = int(parts[0]), parts[1]
             except Exception as e:
-                print('[error]: {}'.format(oldpath), file=sys.stderr)
+                print("invalid line of recent.dat: " + line, file=sys.stderr)
                 raise e
+            recents.append((unixtime, pagename))
+        return recents
 
-    def generate_recent_commit_history(self):
-        recentdatpath = os.path.join(self.basedir, 'cache/recent.dat')
-        prefixlen = len(os.path.join(self.basedir, 'wiki') + os.sep)
-        with open(recentdatpath) as recentdat:
-            for line in recentdat:
-                line = line.strip()
-                parts = line.split('\t')
-                try:
-                    unixtime, pagename = int(parts[0]), parts[1]
-                except Exception as e:
-                    print("invalid line of recent.dat: " + line, file=sys.stderr)
-                    raise e
-                pagepath = os.path.join(self.basedir, 'wiki', pagename + '.txt')
-                if not os.path.exists(pagepath):
-                    continue
-                buf = None
-                with open(pagepath) as page:
-                    buf = page.read()
-                path = pagepath[prefixlen:]
-                self.commit_history.append(Commit(unixtime, path, buf))
+    def iter_recent_commit_history(self):
+        recents = []
+        for unixtime, pagename in self.read_recents():
+            if self.since is None or unixtime > self.since:
+                recents.append((unixtime, pagename + '.txt'))
+        recents.sort(key=lambda recent: recent[0])
+        for unixtime, path in recents:
+            pagepath = os.path.join(self.basedir_abs, 'wiki', path)
+            if self.converter is not None:
+                # direct mode: recent.dat has the page names, but the pages are named in hex
+                pagename, _ = os.path.splitext(path)
+                pagepath = os.path.join(self.basedir_abs, 'wiki', encode_page_name(pagename, self.converter.encoding_from) + '.txt')
+                path = self.converter.generate_new_path(pagepath)[len('wiki' + os.sep):]
+            if not os.path.exists(pagepath):
+                continue
+            buf = self.read_source(pagepath)
+            buf = buf.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            yield Commit(unixtime, path, self.store.add_bytes(buf))
 
     def generate_rename_history(self):
-        pattern = os.path.join(self.basedir, '*/_RenameLog.*')
-        for path in glob.iglob(pattern, recursive=True):
-            openf = open
-            if path.endswith('.gz'):
-                openf = gzip.open
-            with openf(path) as file:
-                self.read_and_update_rename_history(file)
-
-    def read_and_extend_commit_history(self, oldfile, path):
-        self.commit_history.extend(self.read_commit_history(oldfile, path))
-
-    def read_commit_history(self, oldfile, path):
-        history = []
-        unixtime = None
-        buf = ''
-        for line in oldfile:
-            if hasattr(line, 'decode'):
-                line = line.decode('utf-8')
-            match = unixtime_re.match(line)
-            if match:
-                if unixtime != None:
-                    history.append(Commit(unixtime, path, buf))
-                    buf = ''
-                unixtime = int(match.group(1))
-            else:
-                buf += line
-        if unixtime == None:
-            unixtime = datetime.now(timezone.utc).timestamp()
-        history.append(Commit(unixtime, path, buf))
-        return history
+        name = '_RenameLog'
+        if self.converter is not None:
+            name = encode_page_name(':RenameLog', self.converter.encoding_from)
+        pattern = os.path.join(self.basedir_abs, '*', name + '.*')
+        paths = sorted(glob.iglob(pattern, recursive=True))
+        indexed = [self.read_indexed_renames(path) for path in paths]
+        results = self.map_jobs(read_rename_file, [(path, self.reader)
+                                                   for path, history in zip(paths, indexed) if history is None])
+        for path, history in zip(paths, indexed):
+            if history is None:
+                history = next(results)
+                if self.index:
+                    self.index.add_renames(os.path.relpath(path, self.basedir_abs), os.stat(path), history)
+            self.extend_rename_history(history)
+        if self.since is not None:
+            self.rename_history = [rename for rename in self.rename_history if self.is_new(rename)]
 
-    def read_and_update_rename_history(self, file):
-        history = self.read_rename_history(file)
-        self.rename_history.update(history)
+    def read_indexed_renames(self, path):
+        if self.index is None:
+            return None
+        renames = self.index.renames(os.path.relpath(path, self.basedir_abs), os.stat(path))
+        return None if renames is None else [Rename(*rename) for rename in renames]
 
-    def read_rename_history(self, file):
-        history = set()
-        unixtime = None
-        for line in file:
-            if hasattr(line, 'decode'):
-                line = line.decode('utf-8')
-            line = line.strip()
-            match = renamelog_date_re.match(line)
-            if match:
-                y, mo, d, h, mi, s = map(int, match.groups())
-                unixtime = int(datetime(y, mo, d, h, mi, s, 0).timestamp())
+    def print_indexed_revisions(self, page, since=None, until=None):
+        """Print the revisions of `page` in the index (made by a previous run with index_path) without parsing."""
+        if not os.path.exists(self.index_path):
+            print('index \'{}\' does not exist.'.format(self.index_path), file=sys.stderr)
+            exit(1)
+        self.index = RevisionIndex(self.index_path, self.index_options())
+        try:
+            stale = self.index.stale_sources(self.basedir_abs)
+            if stale:
+                print('[warning]: {} files have been changed since they were indexed (e.g. {}); run gitify with '
+                      '--index again to update it'.format(len(stale), stale[0]), file=sys.stderr)
+            if not page.endswith('.txt'):
+                page += '.txt'
+            for revision in self.index.query(page, since, until):
+                date = datetime.fromtimestamp(revision.unixtime).isoformat()
+                print('{}\t{}\t{}\t{}\t{}\t{}'.format(date, revision.unixtime, revision.sha1, revision.source,
+                                                      revision.offset, revision.length))
+        finally:
+            self.index.close(commit=False)
+
+    def extend_rename_history(self, history):
+        # the rename log and its backups have the same entries
+        seen = set(self.rename_history)
+        for rename in history:
+            if rename not in seen:
+                seen.add(rename)
+                self.rename_history.append(rename)
+
+    def generate_attachment_history(self):
+        # the attach plugin does not log when a file was uploaded, so the mtime is used
+        files = []
+        for oldpath, path in self.iter_source_files('attach', ''):
+            if path.endswith('.log') or not os.path.isfile(oldpath):
                 continue
-            match = renamelog_change_re.match(line)
+            # FILE.1, FILE.2, ... are the older generations of FILE kept by the attach plugin
+            match = attach_age_re.search(path)
+            age = int(match.group(1)) if match else None
             if match:
-                page_from = match.group(1)
-                page_to = match.group(2)
-                history.add(Rename(unixtime, page_from + '.txt', page_to + '.txt'))
-                continue
-        return history
+                path = path[:match.start()]
+            files.append((path, age is None, age or 0, oldpath))
+        files.sort()
+        unixtimes = {}
+        for path, _, _, oldpath in reversed(files):
+            unixtime = int(os.stat(oldpath).st_mtime)
+            # an older generation must not come after the current file
+            unixtime = unixtimes[path] = min(unixtime, unixtimes.get(path, unixtime))
+            attachment = Attachment(unixtime, os.path.join('attach', path), oldpath)
+            if self.is_new(attachment):
+                self.attachment_history.append(attachment)
+        self.attachment_history.reverse()
+        self.stats.count('attachment_files', len(self.attachment_history))
+
+    def attachment_sha1(self, oldpath, stat):
+        # hard-linked files are hashed only once
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        sha1 = self.attachment_sha1s.get(key)
+        if sha1 is None:
+            sha1 = self.attachment_sha1s[key] = git_blob_sha1_file(oldpath, stat.st_size)
+        return sha1
+
+    def is_new(self, item):
+        return self.since is None or item.unixtime > self.since
 
     def rename_paths_in_all_history(self):
-        new_history = []
-        latest_to_old_map = {}
-        old_to_latest_map = {}
-        for item in reversed(self.all_history):
-            if type(item) == Commit:
-                unixtime, path, data = item
-                if path in latest_to_old_map:
-                    path = latest_to_old_map[path]
-                new_history.append(Commit(unixtime, path, data))
-            elif type(item) == Rename:
-                unixtime, oldpath, newpath = item
-                if newpath in old_to_latest_map:
-                    latestpath = old_to_latest_map[newpath]
-                    latest_to_old_map[latestpath] = oldpath
-                    latest_to_old_map[newpath] = oldpath
-                    old_to_latest_map[oldpath] = latestpath
-                else:
-                    latest_to_old_map[newpath] = oldpath
-                    old_to_latest_map[oldpath] = newpath
-                new_history.append(item)
-            else:
-                assert False, 'Unknown Type: ' + str(type(item))
-        new_history.reverse()
-        self.all_history = new_history
+        # move commits back to the names the pages had at that time; only renamed pages are rebuilt
+        index = RenameIndex(self.rename_history)
+        for i, item in enumerate(self.all_history):
+            if type(item) == Commit and item.path in index.renames:
+                path = index.resolve(item.path, item.unixtime)
+                if path != item.path:
+                    self.all_history[i] = Commit(item.unixtime, path, item.data)
 
     def generate_git_repository(self):
-        os.makedirs(self.outdir)
+        if self.since is None:
+            os.makedirs(self.outdir)
         oldcwd = os.getcwd()
         os.chdir(self.outdir)
-        # git init
-        self.execute(['git', 'init'], exception=True)
+        if self.since is None:
+            # git init
+            with self.stats.phase('git init'):
+                self.execute(['git', 'init'], exception=True)
         # git config
         if self.name:
             self.execute(['git', 'config', 'user.name', self.name], exception=True)
         if self.email:
             self.execute(['git', 'config', 'user.email', self.email], exception=True)
-        for item in self.all_history:
+        with self.stats.phase('git history'):
+            if self.backend == 'fast-import':
+                self.generate_git_history_fastimport()
+            else:
+                self.generate_git_history_subprocess()
+            self.write_state()
+        with self.stats.phase('git gc'):
+            if self.since is None:
+                self.execute(['git', 'gc'])
+            else:
+                self.execute(['git', 'gc', '--auto'])
+        os.chdir(oldcwd)
+
+    def generate_git_history_subprocess(self):
+        # !!! you must chdir to git repo when you use this function !!!
+        for item in self.iter_progress(self.all_history):
             if type(item) == Commit:
                 self.git_commit(item)
             elif type(item) == Rename:
                 self.git_rename(item)
+            elif type(item) == Attachment:
+                self.git_attachment(item)
             else:
                 assert False, 'Unknown Type: ' + str(type(item))
-        self.git_copy_latests()
-        self.execute(['git', 'gc'])
-        os.chdir(oldcwd)
+            self.mark_written(item)
+        with self.stats.phase('copy latest pages'):
+            self.git_copy_latests()
+
+    def generate_git_history_fastimport(self):
+        # !!! you must chdir to git repo when you use this function !!!
+        ref = self.git_output(['git', 'symbolic-ref', 'HEAD'])
+        ident = self.git_ident()
+        parent = None
+        tree = {}
+        if self.since is not None:
+            # continue the existing branch (ref.) "from" in git-fast-import(1))
+            parent = ref + '^0'
+            if self.watching is not None and self.watching.tree is not None:
+                tree = self.watching.tree
+            else:
+                tree = self.git_tree(ref)
+        with self.stats.command(['git', 'fast-import']):
+            fastimport = GitFastImport(ref, ident, parent=parent, tree=tree)
+            try:
+                for item in self.iter_progress(self.all_history):
+                    if type(item) == Commit:
+                        self.fastimport_commit(fastimport, item)
+                    elif type(item) == Rename:
+                        self.fastimport_rename(fastimport, item)
+                    elif type(item) == Attachment:
+                        self.fastimport_attachment(fastimport, item)
+                    else:
+                        assert False, 'Unknown Type: ' + str(type(item))
+                    self.mark_written(item)
+                with self.stats.phase('copy latest pages'):
+                    self.fastimport_copy_latests(fastimport)
+            finally:
+                fastimport.close()
+                self.stats.count('bytes_written', fastimport.nbytes)
+        if self.watching is not None:
+            self.watching.tree = fastimport.tree
+        # fast-import does not touch the working tree
+        self.execute(['git', 'reset', '--hard', '--quiet'], exception=True)
+
+    def iter_progress(self, history):
+        total = len(history) if isinstance(history, list) else None
+        with self.stats.progress('history', total) as progress:
+            for item in history:
+                yield item
+                self.stats.count({Commit: 'commits', Rename: 'renames', Attachment: 'attachments'}[type(item)])
+                progress.update()
+
+    def mark_written(self, item):
+        if self.last_unixtime is None or item.unixtime > self.last_unixtime:
+            self.last_unixtime = item.unixtime
+        if type(item) == Commit:
+            self.touched_paths.add(self.generate_commit_path(item.path))
+        elif type(item) == Rename:
+            self.touched_paths.add(self.generate_commit_path(item.oldpath))
+            self.touched_paths.add(self.generate_commit_path(item.newpath))
+
+    def read_state(self):
+        # the state ref written by write_state(), or the newest PukiWiki commit
+        proc = self.stats.run(['git', 'cat-file', 'blob', state_ref], cwd=self.outdir,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if proc.returncode == 0:
+            return json.loads(proc.stdout.decode('utf-8'))['unixtime']
+        proc = self.stats.run(['git', 'log', '--format=%at %s'], cwd=self.outdir, stdout=subprocess.PIPE)
+        unixtimes = []
+        for line in proc.stdout.decode('utf-8').splitlines():
+            unixtime, _, subject = line.partition(' ')
+            if subject.endswith(' (PukiWiki)'):
+                unixtimes.append(int(unixtime))
+        if not unixtimes:
+            raise Exception('cannot find the last migrated commit in ' + self.outdir)
+        return max(unixtimes)
+
+    def write_state(self):
+        # !!! you must chdir to git repo when you use this function !!!
+        if self.last_unixtime is None:
+            return
+        state = json.dumps({'unixtime': int(self.last_unixtime)}).encode('utf-8')
+        proc = self.stats.run(['git', 'hash-object', '-w', '--stdin'], input=state, stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception('failed: git hash-object, return code: {}'.format(proc.returncode))
+        sha1 = proc.stdout.decode('ascii').strip()
+        self.execute(['git', 'update-ref', state_ref, sha1], exception=True)
+
+    def git_tree(self, ref):
+        # !!! you must chdir to git repo when you use this function !!!
+        tree = {}
+        proc = self.stats.run(['git', 'ls-tree', '-r', '-z', '--full-tree', ref], stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception('failed: git ls-tree, return code: {}'.format(proc.returncode))
+        for entry in proc.stdout.split(b'\0'):
+            if not entry:
+                continue
+            info, path = entry.split(b'\t', 1)
+            _, objtype, sha1 = info.decode('ascii').split(' ')
+            if objtype == 'blob':
+                tree[os.fsdecode(path)] = sha1
+        return tree
+
+    def iter_latest_pages(self):
+        if self.watching is not None:
+            for newpath, oldpath in sorted(self.watching.pages.items()):
+                yield oldpath, newpath
+            return
+        for oldpath, newpath in self.iter_source_files('wiki', '.txt'):
+            if newpath.startswith("_"):
+                continue
+            yield oldpath, self.generate_commit_path(newpath)
+
+    def is_latest_page_changed(self, oldpath, newpath):
+        if self.watching is not None:
+            return newpath in self.touched_paths or newpath in self.watching.changed_pages
+        if self.since is None or newpath in self.touched_paths:
+            return True
+        return os.stat(oldpath).st_mtime > self.since
 
     def generate_commit_path(self, path):
         if self.directcontents:
@@ -218,6 +1070,21 @@ class Gitify:
                 return path[len(prefix):]
         return path
 
+    def generate_commit_message(self, path):
+        name, _ = os.path.splitext(path)
+        name = self.remove_path_prefix(name)
+        return name + ' (PukiWiki)'
+
+    def generate_attachment_message(self, path):
+        return os.path.relpath(path, 'attach') + ' (PukiWiki attachment)'
+
+    def generate_rename_message(self, oldpath, newpath):
+        oldname, _ = os.path.splitext(oldpath)
+        oldname = self.remove_path_prefix(oldname)
+        newname, _ = os.path.splitext(newpath)
+        newname = self.remove_path_prefix(newname)
+        return oldname + ' → ' + newname + ' (PukiWiki)'
+
     def git_commit(self, commit):
         # !!! you must chdir to git repo when you use this function !!!
         date = datetime.utcfromtimestamp(commit.unixtime).isoformat() + "Z"
@@ -227,29 +1094,42 @@ class Gitify:
         dirname = os.path.dirname(path)
         if dirname and not os.path.exists(dirname):
             os.makedirs(dirname)
-        with open(path, 'w') as file:
-            file.write(commit.data)
+        with open(path, 'wb') as file:
+            file.write(self.read_commit_data(commit))
         # git add
         self.execute(['git', 'add', path], exception=True)
         if self.git_repository_has_no_diff():
             return
-        name, _ = os.path.splitext(path)
-        name = self.remove_path_prefix(name)
         # git commit
-        if self.execute(['git', 'commit', '-m', name + ' (PukiWiki)']):
+        if self.execute(['git', 'commit', '-m', self.generate_commit_message(path)]):
             # FIXME: workaround... (git add failure)
             # git add .
             self.execute(['git', 'add', '.'])
             # git diff --cached --name-only (obtain changed file name)
-            p = subprocess.run(['git', 'diff', '--cached', '--name-only'], stdout=subprocess.PIPE)
-            name, _ = os.path.splitext(p.stdout.decode('utf-8').strip())
-            name = self.remove_path_prefix(name)
+            p = self.stats.run(['git', 'diff', '--cached', '--name-only'], stdout=subprocess.PIPE)
+            path = p.stdout.decode('utf-8').strip()
             # git commit
-            self.execute(['git', 'commit', '-m', name + ' (PukiWiki)'])
+            self.execute(['git', 'commit', '-m', self.generate_commit_message(path)])
+
+    def git_attachment(self, attachment):
+        # !!! you must chdir to git repo when you use this function !!!
+        date = datetime.utcfromtimestamp(attachment.unixtime).isoformat() + "Z"
+        os.environ['GIT_COMMITTER_DATE'] = date
+        os.environ['GIT_AUTHOR_DATE'] = date
+        dirname = os.path.dirname(attachment.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        shutil.copyfile(attachment.oldpath, attachment.path)
+        # git add
+        self.execute(['git', 'add', attachment.path], exception=True)
+        if self.git_repository_has_no_diff():
+            return
+        # git commit
+        self.execute(['git', 'commit', '-m', self.generate_attachment_message(attachment.path)])
 
     def git_rename(self, rename):
         # !!! you must chdir to git repo when you use this function !!!
-        date = datetime.utcfromtimestamp(rename.unixtime).isoformat()
+        date = datetime.utcfromtimestamp(rename.unixtime).isoformat() + "Z"
         os.environ['GIT_COMMITTER_DATE'] = date
         os.environ['GIT_AUTHOR_DATE'] = date
         oldpath = self.generate_commit_path(rename.oldpath)
@@ -257,16 +1137,16 @@ class Gitify:
         if os.path.exists(newpath):
             # git rm
             self.execute(['git', 'rm', newpath])
+        # git mv fails if the destination directory does not exist (e.g. OldProject/Sub → Project/Sub)
+        dirname = os.path.dirname(newpath)
+        if dirname and not os.path.exists(dirname) and os.path.exists(oldpath):
+            os.makedirs(dirname)
         # git mv
         self.execute(['git', 'mv', oldpath, newpath])
         if self.git_repository_has_no_diff():
             return
-        oldname, _ = os.path.splitext(oldpath)
-        oldname = self.remove_path_prefix(oldname)
-        newname, _ = os.path.splitext(newpath)
-        newname = self.remove_path_prefix(newname)
         # git commit
-        self.execute(['git', 'commit', '-m', oldname + ' → ' + newname + ' (PukiWiki)'])
+        self.execute(['git', 'commit', '-m', self.generate_rename_message(oldpath, newpath)])
 
     def git_copy_latests(self):
         # !!! you must chdir to git repo when you use this function !!!
@@ -275,20 +1155,26 @@ class Gitify:
             del os.environ['GIT_COMMITTER_DATE']
         if 'GIT_AUTHOR_DATE' in os.environ:
             del os.environ['GIT_AUTHOR_DATE']
+        latests = {newpath: oldpath for oldpath, newpath in self.iter_latest_pages()}
         for rmpath in glob.iglob('**/*.txt', recursive=True):
+            if self.attachments and rmpath.startswith('attach' + os.sep):
+                continue
+            if self.since is not None and rmpath in latests:
+                # update mode: keep pages which still exist
+                continue
             # git rm (wiki-repo/*)
             self.execute(['git', 'rm', rmpath], exception=True)
-        pattern = os.path.join(self.basedir_abs, 'wiki/**/*.txt')
-        prefixlen = len(os.path.join(self.basedir_abs, 'wiki') + os.sep)
-        for oldpath in glob.iglob(pattern, recursive=True):
-            newpath = oldpath[prefixlen:]
-            if newpath.startswith("_"):
+        for newpath, oldpath in latests.items():
+            if not self.is_latest_page_changed(oldpath, newpath) and os.path.exists(newpath):
                 continue
-            newpath = self.generate_commit_path(newpath)
             dirname = os.path.dirname(newpath)
             if dirname and not os.path.exists(dirname):
                 os.makedirs(dirname)
-            shutil.copy(oldpath, newpath)
+            if self.reader is None:
+                shutil.copy(oldpath, newpath)
+            else:
+                with open(newpath, 'wb') as newfile:
+                    newfile.write(self.read_source(oldpath))
             # git add (wiki/*)
             self.execute(['git', 'add', newpath], exception=True)
         if self.git_repository_has_no_diff():
@@ -296,6 +1182,351 @@ class Gitify:
         # git commit
         self.execute(['git', 'commit', '-m', 'migrated from PukiWiki using migpuki'])
 
+    def read_commit_data(self, commit):
+        return self.store.read(commit.data)
+
+    def fastimport_commit(self, fastimport, commit):
+        path = self.generate_commit_path(commit.path)
+        if fastimport.write_blob(path, commit.data.sha1, lambda: self.store.read(commit.data)):
+            fastimport.commit(commit.unixtime, self.generate_commit_message(path))
+
+    def fastimport_attachment(self, fastimport, attachment):
+        stat = os.stat(attachment.oldpath)
+        sha1 = self.attachment_sha1(attachment.oldpath, stat)
+        # identical files attached to several pages are sent only once
+        if fastimport.write_blob_file(attachment.path, sha1, attachment.oldpath, stat.st_size):
+            fastimport.commit(attachment.unixtime, self.generate_attachment_message(attachment.path))
+
+    def fastimport_rename(self, fastimport, rename):
+        oldpath = self.generate_commit_path(rename.oldpath)
+        newpath = self.generate_commit_path(rename.newpath)
+        # same as `git rm <newpath>` and `git mv <oldpath> <newpath>`
+        if oldpath != newpath:
+            fastimport.delete_file(newpath)
+        fastimport.rename_file(oldpath, newpath)
+        fastimport.commit(rename.unixtime, self.generate_rename_message(oldpath, newpath))
+
+    def fastimport_copy_latests(self, fastimport):
+        print('* finalizing...')
+        latests = {newpath: oldpath for oldpath, newpath in self.iter_latest_pages()}
+        for path in list(fastimport.tree):
+            if self.attachments and path.startswith('attach/'):
+                continue
+            if path not in latests and path.endswith('.txt'):
+                fastimport.delete_file(path)
+        for newpath, oldpath in latests.items():
+            if not self.is_latest_page_changed(oldpath, newpath) and newpath in fastimport.tree:
+                continue
+            fastimport.write_file(newpath, self.read_source(oldpath))
+        fastimport.commit(time.time(), 'migrated from PukiWiki using migpuki', tz=local_timezone())
+
+    def watch(self, interval):
+        """Keep the repository in outdir up to date with the source tree, polling it every `interval` seconds.
+
+        The first pass migrates (or updates) as usual. After that, the latest
+        pages, the decoded page names, the sizes and mtimes of the source
+        files and the entries of the directories are kept in memory, so each
+        poll stat()s only recent.dat and the directories; pages are edited in
+        place and listed in recent.dat, while created, removed or renamed files
+        change their directories, whose listings are compared with the entries
+        in memory. Only the files found by a poll are stat()ed, and only the
+        changed pages and backup files are read and committed.
+        A failed poll or sync (e.g. a gzipped backup file which PukiWiki is
+        still writing) is logged and retried at the next poll with the same
+        changes. Stops on SIGINT or SIGTERM.
+        """
+        self.update = True
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        # scanned before the first pass, so that the files changed during it are found by the first poll
+        state = self.scan_watched_sources()
+        self.run()
+        self.watching = state
+        print('* watching {} every {} seconds...'.format(self.basedir, interval))
+        try:
+            while not stopping:
+                time.sleep(interval)
+                try:
+                    self.poll_sources()
+                    self.stats.count('polls')
+                    if state.has_changes():
+                        self.sync()
+                except Exception:
+                    traceback.print_exc()
+                    print('[error]: failed to update git repo; retrying at the next poll', file=sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        print('* stopped watching.')
+
+    def sync(self):
+        state = self.watching
+        # the repository exists after the first pass, even if nothing was migrated
+        self.since = self.last_unixtime if self.last_unixtime is not None else 0
+        self.touched_paths = set()
+        print('* {}: {} pages and {} backup files have been changed; updating git repo...'.format(
+            datetime.now().replace(microsecond=0).isoformat(), len(state.changed_pages), len(state.backup_files)))
+        self.stats.count('syncs')
+        oldcwd = os.getcwd()
+        try:
+            self.migrate()
+        except Exception:
+            # generate_git_repository() does not chdir back on errors; the state in memory may be ahead of
+            # the repository, so the next sync reads it again (the same changes are skipped by their blobs)
+            os.chdir(oldcwd)
+            self.last_unixtime = self.read_state()
+            state.tree = None
+            raise
+        # kept until they are committed, so that a failed sync is retried with them
+        state.clear_changes()
+
+    def scan_watched_sources(self):
+        state = WatchState()
+        recentdatpath = os.path.join(self.basedir_abs, 'cache/recent.dat')
+        state.recent_mtime = stat_mtime(recentdatpath)
+        if state.recent_mtime is not None:
+            state.recents = {pagename: unixtime for unixtime, pagename in self.read_recents()}
+        found = set()
+        for dirname in ['wiki', 'backup'] + (['attach'] if self.attachments else []):
+            self.watch_directory(state, os.path.join(self.basedir_abs, dirname), found)
+        self.update_watched_files(state, found)
+        state.clear_changes()
+        return state
+
+    def poll_sources(self):
+        """Find the pages and backup files changed since the last poll, and record them in `watching`."""
+        state = self.watching
+        candidates = set()
+        recentdatpath = os.path.join(self.basedir_abs, 'cache/recent.dat')
+        mtime = stat_mtime(recentdatpath)
+        if mtime != state.recent_mtime:
+            # read before the mtime is recorded, so that a recent.dat being written is read again
+            recents = self.read_recents() if mtime is not None else []
+            state.recent_mtime = mtime
+            for unixtime, pagename in recents:
+                if state.recents.get(pagename) != unixtime:
+                    state.recents[pagename] = unixtime
+                    candidates.update(self.iter_page_sources(pagename))
+        for dirpath, (mtime, _) in list(state.dirs.items()):
+            # a subdirectory may have been removed with its parent in this loop
+            if dirpath not in state.dirs or stat_mtime(dirpath) == mtime:
+                continue
+            if self.watched_dirname(dirpath) == 'attach':
+                state.attachments_changed = True
+            # files in it have been created, removed or renamed
+            self.watch_directory(state, dirpath, candidates)
+        self.update_watched_files(state, candidates)
+
+    def watch_directory(self, state, dirpath, found):
+        # record the mtime (taken before listing it) and the entries of `dirpath`, and add the files
+        # which have been added or removed since the last listing to `found`
+        mtime = stat_mtime(dirpath)
+        if mtime is None:
+            self.unwatch_directory(state, dirpath, found)
+            return
+        _, oldnames = state.dirs.get(dirpath, (None, set()))
+        entries = {entry.name: entry for entry in os.scandir(dirpath) if not entry.name.startswith('.')}
+        names = set(entries)
+        state.dirs[dirpath] = (mtime, names)
+        for name in oldnames - names:
+            path = os.path.join(dirpath, name)
+            if path in state.dirs:
+                self.unwatch_directory(state, path, found)
+            else:
+                found.add(path)
+        for name in names - oldnames:
+            entry = entries[name]
+            if entry.is_dir():
+                self.watch_directory(state, entry.path, found)
+            else:
+                found.add(entry.path)
+
+    def unwatch_directory(self, state, dirpath, found):
+        # a removed directory: all the files in it have been removed
+        _, names = state.dirs.pop(dirpath, (None, set()))
+        for name in names:
+            path = os.path.join(dirpath, name)
+            if path in state.dirs:
+                self.unwatch_directory(state, path, found)
+            else:
+                found.add(path)
+
+    def update_watched_files(self, state, oldpaths):
+        # compare the files with their sizes and mtimes in memory
+        for oldpath in sorted(oldpaths):
+            dirname = self.watched_dirname(oldpath)
+            name = os.path.basename(oldpath)
+            if dirname not in ('wiki', 'backup') or name == 'dir.txt':
+                continue
+            _, ext = os.path.splitext(name)
+            if ext not in (['.txt'] if dirname == 'wiki' else ['.txt', '.gz']):
+                continue
+            try:
+                stat = os.stat(oldpath)
+                key = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                key = None
+            if state.files.get(oldpath) == key:
+                continue
+            if key is None:
+                del state.files[oldpath]
+            else:
+                state.files[oldpath] = key
+            path = self.watched_source_path(state, oldpath, dirname)
+            if dirname == 'wiki':
+                if path.startswith('_'):
+                    continue
+                newpath = self.generate_commit_path(path)
+                if key is None:
+                    state.pages.pop(newpath, None)
+                else:
+                    state.pages[newpath] = oldpath
+                state.changed_pages.add(newpath)
+            elif key is not None:
+                path = path[:-len(ext)] + '.txt'
+                if path != '_RenameLog.txt':
+                    state.backup_files[oldpath] = (oldpath, path, ext == '.gz')
+
+    def iter_page_sources(self, pagename):
+        # the files of a page listed in recent.dat
+        if self.converter is not None:
+            pagename = encode_page_name(pagename, self.converter.encoding_from)
+        yield os.path.join(self.basedir_abs, 'wiki', pagename + '.txt')
+        for ext in ['.txt', '.gz']:
+            yield os.path.join(self.basedir_abs, 'backup', pagename + ext)
+
+    def watched_dirname(self, path):
+        return os.path.relpath(path, self.basedir_abs).split(os.sep)[0]
+
+    def watched_source_path(self, state, oldpath, dirname):
+        # the same path as iter_source_files() yields for `oldpath`
+        if self.converter is None:
+            return os.path.relpath(oldpath, os.path.join(self.basedir_abs, dirname))
+        return self.converter.generate_new_path(oldpath, names=state.names)[len(dirname + os.sep):]
+
+    def verify(self, *, backups=False):
+        """Compare the repository in outdir with the source files by git blob SHA-1, without a checkout.
+
+        The latest pages (and attachments) must be the same as the tree of
+        HEAD, listed by a single `git ls-tree`. With `backups`, every backup
+        revision must also be in the history, listed by a single
+        `git rev-list --objects`. Returns True if nothing is missing, extra or
+        mismatched.
+        """
+        if not os.path.exists(self.outdir):
+            print('output directory \'{}\' does not exist.'.format(self.outdir), file=sys.stderr)
+            exit(1)
+        problems = []  # [(kind, path)]
+        print('* verifying latest pages...')
+        with self.stats.phase('verify pages'):
+            expected, optional = self.expected_tree()
+            oldcwd = os.getcwd()
+            os.chdir(self.outdir)
+            try:
+                tree = self.git_tree('HEAD')
+            finally:
+                os.chdir(oldcwd)
+            for path in sorted(set(expected) | set(tree)):
+                if path not in expected:
+                    if self.is_verified_path(path) and path not in optional:
+                        problems.append(('extra', path))
+                elif path not in tree:
+                    problems.append(('missing', path))
+                elif expected[path] != tree[path]:
+                    problems.append(('mismatched', path))
+            self.stats.count('verified_files', len(expected))
+        if backups:
+            print('* verifying backup revisions...')
+            with self.stats.phase('verify backups'):
+                objects = self.git_objects()
+                if self.index_path:
+                    # the SHA-1s of unchanged backup files (gzipped ones, too) are read from the index
+                    # without parsing them
+                    self.index = RevisionIndex(self.index_path, self.index_options())
+                succeeded = False
+                with tempfile.TemporaryDirectory(prefix='gitify-') as self.tmpdir:
+                    self.store = RevisionStore(self.tmpdir, reader=self.reader)
+                    try:
+                        files = list(self.iter_backup_files())
+                        indexed = [self.read_indexed_revisions(oldpath, gz, sliced=False) for oldpath, _, gz in files]
+                        parsed = self.parse_backup_files([file for file, revisions in zip(files, indexed)
+                                                          if revisions is None])
+                        for revisions in indexed:
+                            if revisions is not None:
+                                history = [(revision.page, revision.unixtime, revision.sha1) for revision in revisions]
+                            else:
+                                history = [(commit.path, commit.unixtime, commit.data.sha1) for commit in next(parsed)]
+                            for path, unixtime, sha1 in history:
+                                if sha1 not in objects:
+                                    problems.append(('missing revision', '{} at {}'.format(
+                                        path, datetime.utcfromtimestamp(unixtime).isoformat() + 'Z')))
+                            self.stats.count('verified_revisions', len(history))
+                        succeeded = True
+                    finally:
+                        self.store.close()
+                        if self.index:
+                            self.index.close(commit=succeeded)
+        for kind, path in problems:
+            print('[{}]: {}'.format(kind, path), file=sys.stderr)
+        counts = {kind: sum(1 for k, _ in problems if k == kind)
+                  for kind in ['missing', 'extra', 'mismatched', 'missing revision']}
+        print('* {} files verified: {missing} missing, {extra} extra, {mismatched} mismatched'.format(
+            self.stats.counters.get('verified_files', 0), **counts))
+        if backups:
+            print('* {} backup revisions verified: {} missing'.format(
+                self.stats.counters.get('verified_revisions', 0), counts['missing revision']))
+        self.stats.write()
+        return not problems
+
+    def expected_tree(self):
+        """Return {path in git repo: blob SHA-1} of the latest files, and the paths which may or may not exist."""
+        files = [(newpath, oldpath, self.reader) for oldpath, newpath in self.iter_latest_pages()]
+        optional = set()
+        if self.attachments:
+            for oldpath, path in self.iter_source_files('attach', ''):
+                if path.endswith('.log') or not os.path.isfile(oldpath):
+                    continue
+                match = attach_age_re.search(path)
+                if match:
+                    # the content of a path which has only older generations depends on their order
+                    optional.add(os.path.join('attach', path[:match.start()]))
+                    continue
+                files.append((os.path.join('attach', path), oldpath, None))
+        sha1s = self.map_jobs(hash_source_file, [(oldpath, reader) for _, oldpath, reader in files])
+        return {newpath: sha1 for (newpath, _, _), sha1 in zip(files, sha1s)}, optional
+
+    def is_verified_path(self, path):
+        if path.startswith('attach/'):
+            return self.attachments
+        return path.endswith('.txt')
+
+    def git_objects(self):
+        # all the objects in the history, streamed from a single git process
+        objects = set()
+        command = ['git', 'rev-list', '--objects', '--all']
+        with self.stats.command(command):
+            proc = subprocess.Popen(command, cwd=self.outdir, stdout=subprocess.PIPE)
+            for line in proc.stdout:
+                objects.add(line[:40].decode('ascii'))
+            returncode = proc.wait()
+        if returncode != 0:
+            raise Exception('failed: git rev-list, return code: {}'.format(returncode))
+        return objects
+
+    def git_ident(self):
+        # !!! you must chdir to git repo when you use this function !!!
+        # git var GIT_COMMITTER_IDENT (e.g. "name <email> 1234567890 +0900")
+        ident = self.git_output(['git', 'var', 'GIT_COMMITTER_IDENT'])
+        match = ident_re.match(ident)
+        if not match:
+            raise Exception('unexpected git ident: ' + ident)
+        return match.group(1)
+
+    def git_output(self, command):
+        proc = self.stats.run(command, stdout=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise Exception('failed: {}, return code: {}'.format(' '.join(command), proc.returncode))
+        return proc.stdout.decode('utf-8').strip()
+
     def git_repository_has_no_diff(self):
         # !!! you must chdir to git repo when you use this function !!!
         # git diff-index
@@ -309,9 +1540,9 @@ class Gitify:
     def execute(self, command, *, silent=False, exception=False):
         proc = None
         if silent:
-            proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            proc = self.stats.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         else:
-            proc = subprocess.run(command, stdout=subprocess.PIPE)
+            proc = self.stats.run(command, stdout=subprocess.PIPE)
         message = proc.stdout.decode('utf-8')
         if not silent:
             if proc.returncode != 0:
@@ -325,7 +1556,8 @@ class Gitify:
 def main():
     parser = argparse.ArgumentParser(description='gitify PukiWiki data.')
     parser.add_argument('basedir',
-                        help='UTF-8ized PukiWiki root directory (which has wiki, backup and cache directories) using convpuki')
+                        help='UTF-8ized PukiWiki root directory (which has wiki, backup and cache directories) using convpuki, '
+                             'or the original one with --direct')
     parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
                         help='show verbose log')
     parser.add_argument('-o', '--outdir', default='pukiwiki-repo',
@@ -336,9 +1568,66 @@ def main():
     parser.add_argument('-e', '--email', help='git author and committer email')
     parser.add_argument('-r', '--renamelog', dest='renamelog', action='store_true', default=False,
                         help='parse rename log and execute git mv (experimental)')
-    params = parser.parse_args()
+    parser.add_argument('-b', '--backend', default='fast-import',
+                        help='how to create git history: fast-import (default) or subprocess')
+    parser.add_argument('-s', '--streaming', dest='streaming', action='store_true', default=False,
+                        help='merge backup files lazily instead of loading the whole history into memory')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to parse backup files (default: 1)')
+    parser.add_argument('-U', '--update', dest='update', action='store_true', default=False,
+                        help='append revisions newer than the last run to the existing repository in <outdir>')
+    parser.add_argument('--max-open-files', dest='max_open_files', type=int, default=256,
+                        help='number of backup files merged at once in streaming mode; '
+                             'more files are merged through temporary files (default: 256)')
+    parser.add_argument('-a', '--attachments', dest='attachments', action='store_true', default=False,
+                        help='import attached files into attach/ at their modification times')
+    parser.add_argument('-D', '--direct', dest='direct', action='store_true', default=False,
+                        help='read the original PukiWiki data (not converted by convpuki) and convert it in memory')
+    parser.add_argument('-f', '--encoding_from', default='euc_jp',
+                        help='encoding of PukiWiki data in direct mode: euc_jp (default) or utf-8')
+    parser.add_argument('-u', '--normalization', default='NFC',
+                        help='unicode normalization mode for page names in direct mode: NFC (default), NFD, NFKC or NFKD')
+    parser.add_argument('--stats', dest='stats_path', metavar='FILE',
+                        help='show the progress and write the timings and counters of each phase to FILE as JSON')
+    parser.add_argument('--index', dest='index_path', metavar='FILE',
+                        help='record the revisions in an SQLite index FILE, and read unchanged backup files from it')
+    parser.add_argument('--query', metavar='PAGE',
+                        help='print the revisions of PAGE in the index given by --index and exit')
+    parser.add_argument('--query-since', dest='query_since', metavar='DATE', type=parse_date,
+                        help='print only the revisions at or after DATE (YYYY-MM-DD[ HH:MM:SS] in local time, or unixtime)')
+    parser.add_argument('--query-until', dest='query_until', metavar='DATE', type=parse_date,
+                        help='print only the revisions at or before DATE')
+    parser.add_argument('--verify', dest='verify', action='store_true', default=False,
+                        help='compare the repository in <outdir> with the latest pages (and attachments with -a) '
+                             'by blob SHA-1 and exit')
+    parser.add_argument('--verify-backups', dest='verify_backups', action='store_true', default=False,
+                        help='with --verify, also check that every backup revision is in the history')
+    parser.add_argument('--watch', dest='watch', type=float, default=None, metavar='SECONDS',
+                        help='keep running and commit the changes of <basedir> to <outdir> (implies -U), '
+                             'polling every SECONDS seconds (fast-import backend only)')
+    params = vars(parser.parse_args())
+    watch = params.pop('watch')
+    if watch is not None and (watch <= 0 or params['backend'] != 'fast-import'):
+        parser.error('--watch needs a positive interval and the fast-import backend')
+    verify = params.pop('verify')
+    verify_backups = params.pop('verify_backups')
+    query = params.pop('query')
+    query_since = params.pop('query_since')
+    query_until = params.pop('query_until')
 
-    gitify = Gitify(**vars(params))
+    gitify = Gitify(**params)
+    if query is not None:
+        if not params['index_path']:
+            parser.error('--query requires --index')
+        gitify.print_indexed_revisions(query, query_since, query_until)
+        return
+    if watch is not None:
+        gitify.watch(watch)
+        return
+    if verify or verify_backups:
+        if not gitify.verify(backups=verify_backups):
+            exit(1)
+        return
     gitify.run()
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# requirements: Python 3.5
+
+import argparse
+import codecs
+import gzip as gziplib
+import os
+import os.path
+import shutil
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+RepairPukiResult = namedtuple('RepairPukiResult', ['rawpath', 'newpath', 'bakpath', 'substitutions'])
+raw_extname = '.euc_jp'
+bak_extname = '.bak'
+max_reported_substitutions = 10
+
+# errors handler which decodes the vendor extensions of CP51932 / eucJP-ms and records what was substituted
+_substitutions = threading.local()
+
+def _substitute_vendor_character(e):
+    data = e.object
+    start = e.start
+    char = None
+    if start + 1 < len(data) and 0xA1 <= data[start] <= 0xFE and 0xA1 <= data[start + 1] <= 0xFE:
+        # NEC special characters (row 13) and NEC-selected IBM extensions (rows 89-92) are
+        # at the same code points as in CP932, like nkf -E does
+        try:
+            char = euc_to_sjis(data[start], data[start + 1]).decode('cp932')
+        except UnicodeDecodeError:
+            pass
+    if char is not None:
+        end = start + 2
+    else:
+        char = '\ufffd'
+        end = e.end
+    _substitutions.list.append((start, bytes(data[start:end]), char))
+    return (char, end)
+
+codecs.register_error('repairpuki-vendor', _substitute_vendor_character)
+
+class RepairPuki:
+    """Repair the outputs of convpuki which could not be decoded, from the raw copies (*.euc_jp).
+
+    This is an in-process replacement of contrib/nkfy.sh: each output is
+    renamed to *.bak (only once) and written again from the raw copy, decoded
+    with the vendor extensions of CP51932 which Python's euc_jp does not have.
+    """
+
+    def __init__(self, basedir, *, verbose=False, jobs=1, backup=True):
+        self.basedir = basedir
+        self.verbose = verbose
+        self.jobs = jobs
+        self.backup = backup
+        self.validate()
+
+    def validate(self):
+        if self.jobs < 1:
+            raise ValueError('invalid number of jobs: ' + str(self.jobs))
+
+    def run(self):
+        print('* scanning {} ...'.format(self.basedir))
+        rawpaths = list(self.iter_raw_files())
+        print('* repairing {} files ...'.format(len(rawpaths)))
+        if self.jobs > 1:
+            with ProcessPoolExecutor(self.jobs) as executor:
+                # map() keeps the order, so the report is the same as the serial run
+                chunksize = max(1, min(64, len(rawpaths) // (self.jobs * 4)))
+                results = list(executor.map(self.repair_file, rawpaths, chunksize=chunksize))
+        else:
+            results = [self.repair_file(rawpath) for rawpath in rawpaths]
+        for result in results:
+            self.report_file(result)
+        self.report_summary(results)
+        return results
+
+    def iter_raw_files(self):
+        for dirpath, dirnames, filenames in os.walk(self.basedir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(raw_extname):
+                    yield os.path.join(dirpath, filename)
+
+    def repair_file(self, rawpath):
+        newpath = rawpath[:-len(raw_extname)]
+        gzip = newpath.endswith('.gz')
+        with (gziplib.open(rawpath, 'rb') if gzip else open(rawpath, 'rb')) as rawfile:
+            data = rawfile.read()
+        _substitutions.list = []
+        newdata = data.decode('euc_jp', errors='repairpuki-vendor').encode('utf-8')
+        substitutions = _substitutions.list
+        _substitutions.list = []
+        bakpath = newpath + bak_extname
+        if self.backup and os.path.exists(newpath) and not os.path.exists(bakpath):
+            # keep the output with errors='replace' of the first run only
+            os.replace(newpath, bakpath)
+        if gzip:
+            # keep the mtime of the source in the gzip header, like convpuki
+            mtime = int(os.stat(rawpath).st_mtime)
+            with gziplib.GzipFile(newpath, 'wb', mtime=mtime) as newfile:
+                newfile.write(newdata)
+        else:
+            with open(newpath, 'wb') as newfile:
+                newfile.write(newdata)
+        # the raw copy has the mtime of the source, which gitify --update relies on
+        shutil.copystat(rawpath, newpath)
+        return RepairPukiResult(rawpath, newpath, bakpath if os.path.exists(bakpath) else None, substitutions)
+
+    def report_file(self, result: RepairPukiResult):
+        unresolved = [s for s in result.substitutions if s[2] == '\ufffd']
+        if not self.verbose and not unresolved:
+            return
+        print('[repair]: {} -> {}'.format(result.rawpath, result.newpath))
+        if result.bakpath:
+            self.printv('[backup]: {}'.format(result.bakpath))
+        substitutions = result.substitutions if self.verbose else unresolved
+        for offset, data, char in substitutions[:max_reported_substitutions]:
+            print('  {} at offset {} -> {!r}'.format(data, offset, char))
+        if len(substitutions) > max_reported_substitutions:
+            print('  ... and {} more'.format(len(substitutions) - max_reported_substitutions))
+
+    def report_summary(self, results):
+        counter = Counter((data, char) for result in results for _, data, char in result.substitutions)
+        unresolved = sum(n for (_, char), n in counter.items() if char == '\ufffd')
+        print('* {} files repaired, {} characters substituted ({} could not be decoded and were replaced with U+FFFD).'
+              .format(len(results), sum(counter.values()), unresolved))
+        if counter:
+            print('  the substituted characters are as follows:')
+            for (data, char), n in sorted(counter.items(), key=lambda item: (-item[1], item[0])):
+                print('  {} -> {!r}: {}'.format(data, char, n))
+
+    def printv(self, *args, **kwargs):
+        if self.verbose:
+            print(*args, **kwargs)
+
+def euc_to_sjis(lead, trail):
+    # EUC-JP -> JIS X 0208 row/cell -> Shift_JIS (rows 85-94 go to 0xEB-0xEF like CP932)
+    j1, j2 = lead - 0x80, trail - 0x80
+    s1 = ((j1 + 1) >> 1) + (0x70 if j1 <= 0x5E else 0xB0)
+    if j1 % 2:
+        s2 = j2 + 0x1F
+        if s2 >= 0x7F:
+            s2 += 1
+    else:
+        s2 = j2 + 0x7E
+    return bytes([s1, s2])
+
+def main():
+    parser = argparse.ArgumentParser(description='repair the files which convpuki could not decode (*.euc_jp)')
+    parser.add_argument('basedir',
+                        help='output directory of convpuki')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', default=False,
+                        help='show verbose log (all the substituted characters)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to repair files (default: 1)')
+    parser.add_argument('-B', '--nobackup', dest='backup', action='store_false', default=True,
+                        help='NOT keep the outputs of convpuki as *.bak')
+    params = parser.parse_args()
+
+    repairpuki = RepairPuki(**vars(params))
+    repairpuki.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# requirements: Python 3.5
+
+import json
+import os
+import os.path
+import sqlite3
+from collections import namedtuple
+
+IndexedRevision = namedtuple('IndexedRevision', ['page', 'unixtime', 'source', 'offset', 'length', 'sha1', 'sliced'])
+IndexedRename = namedtuple('IndexedRename', ['unixtime', 'oldpath', 'newpath'])
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER);
+CREATE TABLE IF NOT EXISTS revisions (
+    source TEXT, seq INTEGER, page TEXT, unixtime INTEGER, offset INTEGER, length INTEGER, sha1 TEXT, sliced INTEGER,
+    PRIMARY KEY (source, seq));
+CREATE INDEX IF NOT EXISTS revisions_page ON revisions (page, unixtime);
+CREATE TABLE IF NOT EXISTS renames (
+    source TEXT, seq INTEGER, unixtime INTEGER, oldpath TEXT, newpath TEXT,
+    PRIMARY KEY (source, seq));
+'''
+
+class RevisionIndex:
+    """SQLite index of the revisions in backup files and the renames in rename logs.
+
+    Source files are recorded by their paths relative to basedir with their
+    size and mtime, and their rows are valid while those are the same, so the
+    index can be kept across runs. The offset and length of a revision are
+    in the decoded content of the file (decompressed, and converted in direct
+    mode); `sliced` revisions are exactly those bytes of the file on disk.
+    The whole index is dropped when it was made with other options.
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(schema)
+        options = json.dumps(options, sort_keys=True)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'options'").fetchone()
+        if row is None or row[0] != options:
+            # the offsets and page names depend on how the files are read
+            for table in ['sources', 'revisions', 'renames']:
+                self.conn.execute('DELETE FROM ' + table)
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('options', ?)", (options,))
+
+    def close(self, *, commit=True):
+        if commit:
+            self.conn.commit()
+        self.conn.close()
+
+    def is_valid(self, source, stat):
+        row = self.conn.execute('SELECT size, mtime FROM sources WHERE source = ?', (source,)).fetchone()
+        return row is not None and tuple(row) == (stat.st_size, stat.st_mtime_ns)
+
+    def revisions(self, source, stat):
+        """Return the revisions of `source` in the order of the file, or None if it has not been indexed as it is."""
+        if not self.is_valid(source, stat):
+            return None
+        rows = self.conn.execute('SELECT page, unixtime, source, offset, length, sha1, sliced FROM revisions '
+                                 'WHERE source = ? ORDER BY seq', (source,))
+        return [IndexedRevision(*row) for row in rows]
+
+    def renames(self, source, stat):
+        """Return the renames of `source` in the order of the log, or None if it has not been indexed as it is."""
+        if not self.is_valid(source, stat):
+            return None
+        rows = self.conn.execute('SELECT unixtime, oldpath, newpath FROM renames WHERE source = ? ORDER BY seq',
+                                 (source,))
+        return [IndexedRename(*row) for row in rows]
+
+    def add_revisions(self, source, stat, revisions):
+        """Replace the rows of `source` with `revisions`, a list of (page, unixtime, offset, length, sha1, sliced)."""
+        self.replace_source(source, stat)
+        self.conn.executemany('INSERT INTO revisions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              ((source, seq, page, unixtime, offset, length, sha1, int(sliced))
+                               for seq, (page, unixtime, offset, length, sha1, sliced) in enumerate(revisions)))
+
+    def add_renames(self, source, stat, renames):
+        """Replace the rows of `source` with `renames`, a list of (unixtime, oldpath, newpath)."""
+        self.replace_source(source, stat)
+        self.conn.executemany('INSERT INTO renames VALUES (?, ?, ?, ?, ?)',
+                              ((source, seq, unixtime, oldpath, newpath)
+                               for seq, (unixtime, oldpath, newpath) in enumerate(renames)))
+
+    def replace_source(self, source, stat):
+        self.conn.execute('DELETE FROM revisions WHERE source = ?', (source,))
+        self.conn.execute('DELETE FROM renames WHERE source = ?', (source,))
+        self.conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', (source, stat.st_size, stat.st_mtime_ns))
+
+    def query(self, page, since=None, until=None):
+        """Return the revisions of `page` (a path such as 'FrontPage.txt') between `since` and `until` by time."""
+        sql = 'SELECT page, unixtime, source, offset, length, sha1, sliced FROM revisions WHERE page = ?'
+        params = [page]
+        if since is not None:
+            sql += ' AND unixtime >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND unixtime <= ?'
+            params.append(until)
+        sql += ' ORDER BY unixtime, source, seq'
+        return [IndexedRevision(*row) for row in self.conn.execute(sql, params)]
+
+    def stale_sources(self, basedir):
+        """Return the indexed source files which have been changed or removed since they were indexed."""
+        stale = []
+        for source, size, mtime in self.conn.execute('SELECT source, size, mtime FROM sources ORDER BY source'):
+            try:
+                stat = os.stat(os.path.join(basedir, source))
+            except OSError:
+                stale.append(source)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                stale.append(source)
+        return stale
@@ -0,0 +1,33 @@
+# requirements: Python 3.5
+
+import os
+import sys
+from contextlib import contextmanager
+
+if __package__:
+    from .convpuki import ConvPuki
+    from .gitify import Gitify
+else:
+    from convpuki import ConvPuki
+    from gitify import Gitify
+
+@contextmanager
+def redirect_output(logpath):
+    """Write stdout and stderr of this process to `logpath` (run it in a child process)."""
+    with open(logpath, 'w') as log:
+        # the outputs of git go to the log file, too
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+def run_convpuki(basedir, **kwargs):
+    ConvPuki(basedir, **kwargs).run()
+
+def run_gitify(basedir, **kwargs):
+    Gitify(basedir, **kwargs).run()
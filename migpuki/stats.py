@@ -0,0 +1,129 @@
+# requirements: Python 3.5
+
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+class Stats:
+    """Wall and CPU time of phases, counters and timings of subprocesses in a run.
+
+    The progress line is shown and the summary is written to `path` as JSON only when `path` is given.
+    """
+
+    def __init__(self, path=None, *, interval=0.5):
+        self.path = path
+        self.enabled = path is not None
+        self.interval = interval
+        self.phases = []    # [{'name', 'wall', 'cpu'}]
+        self.counters = {}  # {name: number}
+        self.commands = {}  # {name: {'count', 'wall'}}
+        self.wall_start = time.perf_counter()
+        self.cpu_start = cpu_time()
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            self.phases.append({'name': name, 'wall': time.perf_counter() - wall, 'cpu': cpu_time() - cpu})
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def command(self, command):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.commands.setdefault(command_name(command), {'count': 0, 'wall': 0.0})
+            entry['count'] += 1
+            entry['wall'] += time.perf_counter() - start
+
+    def run(self, command, **kwargs):
+        # subprocess.run() which is timed by the subcommand
+        with self.command(command):
+            return subprocess.run(command, **kwargs)
+
+    def progress(self, name, total=None):
+        return Progress(self, name, total)
+
+    def summary(self):
+        return {
+            'wall': time.perf_counter() - self.wall_start,
+            'cpu': cpu_time() - self.cpu_start,
+            'phases': self.phases,
+            'counters': self.counters,
+            'commands': self.commands,
+        }
+
+    def write(self):
+        if not self.enabled:
+            return
+        with open(self.path, 'w') as file:
+            json.dump(self.summary(), file, indent=2, sort_keys=True)
+            file.write('\n')
+
+class Progress:
+    """Live progress line with the throughput and ETA on stderr (only if it is a terminal)."""
+
+    def __init__(self, stats, name, total=None):
+        self.name = name
+        self.total = total
+        self.interval = stats.interval
+        self.visible = stats.enabled and sys.stderr.isatty()
+        self.done = 0
+        self.nbytes = 0
+        self.start = time.perf_counter()
+        self.shown = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.visible and self.shown is not None:
+            self.show(time.perf_counter())
+            print(file=sys.stderr)
+
+    def update(self, n=1, nbytes=0):
+        self.done += n
+        self.nbytes += nbytes
+        if not self.visible:
+            return
+        now = time.perf_counter()
+        if self.shown is None or now - self.shown >= self.interval:
+            self.shown = now
+            self.show(now)
+
+    def show(self, now):
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = '[{}] {}'.format(self.name, self.done)
+        if self.total is not None:
+            line += '/{}'.format(self.total)
+        line += ' ({:.1f}/s'.format(rate)
+        if self.nbytes and elapsed > 0:
+            line += ', {:.1f} MiB/s'.format(self.nbytes / elapsed / (1024 * 1024))
+        if self.total is not None and rate > 0:
+            line += ', ETA {}'.format(format_seconds((self.total - self.done) / rate))
+        line += ')'
+        sys.stderr.write('\r' + line + '\033[K')
+        sys.stderr.flush()
+
+def cpu_time():
+    # including the finished subprocesses (e.g. git and worker processes)
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def command_name(command):
+    if len(command) >= 2 and os.path.basename(command[0]) == 'git':
+        return 'git ' + command[1]
+    return os.path.basename(command[0])
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return '{}:{:02}:{:02}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)